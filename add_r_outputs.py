@@ -5,37 +5,56 @@ This handles cases where knitr executed R code and generated output,
 but the output is not explicitly in the Rmd source.
 """
 
-import re
-from bs4 import BeautifulSoup
+import mmap
+import os
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from concurrent.futures import ProcessPoolExecutor
 import sys
 
+# Delimiters of the R code inside a PTX <program> block
+CDATA_OPEN = '<input><![CDATA['
+CDATA_CLOSE = ']]></input>'
+
 def extract_r_outputs_from_html(html_file):
     """Extract R code blocks and their outputs from HTML"""
-    with open(html_file, 'r', encoding='utf-8') as f:
-        html_content = f.read()
+    # Only the sourceCode divs and their <pre> output siblings matter, so
+    # skip building the rest of the page (navigation, TOC, MathJax spans)
+    strainer = SoupStrainer(['div', 'pre'])
     
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # Hand the mapped bytes straight to lxml, which decodes them itself,
+    # instead of first decoding the whole page into a Python str
+    with open(html_file, 'rb') as f:
+        # An empty file cannot be mapped, and has no outputs anyway
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            soup = BeautifulSoup(mm, 'lxml', parse_only=strainer, from_encoding='utf-8')
     
-    # Find all R code blocks (sourceCode r) followed by output blocks
+    # Find all R code blocks (sourceCode r) followed by output blocks in a
+    # single walk over the tree: remember each R source div, then pair it
+    # with the <pre> that is its next element sibling. Checking node names
+    # directly is much cheaper than bs4's generic find_all() filter.
     outputs = []
+    r_code_by_div = {}
     
-    # Find all divs with class sourceCode
-    source_divs = soup.find_all('div', class_='sourceCode')
-    
-    for source_div in source_divs:
-        # Get the R code
-        code_elem = source_div.find('code', class_='sourceCode r')
-        if not code_elem:
-            continue
-            
-        # Extract the actual R code text
-        r_code = code_elem.get_text()
-        r_code = r_code.strip()
+    for node in soup.descendants:
+        if node.name == 'div':
+            if 'sourceCode' in node.get('class', ()):
+                # Get the R code
+                code_elem = node.find('code', class_='sourceCode r')
+                if code_elem:
+                    r_code_by_div[id(node)] = code_elem.get_text().strip()
         
-        # Look for the next sibling that's a <pre><code> (output)
-        next_elem = source_div.find_next_sibling()
-        if next_elem and next_elem.name == 'pre':
-            code_elem = next_elem.find('code')
+        elif node.name == 'pre' and r_code_by_div:
+            # Is this <pre> directly preceded by an R source div?
+            prev_elem = node.previous_sibling
+            while prev_elem is not None and not isinstance(prev_elem, Tag):
+                prev_elem = prev_elem.previous_sibling
+            r_code = r_code_by_div.pop(id(prev_elem), None)
+            if r_code is None:
+                continue
+            
+            code_elem = node.find('code')
             if code_elem:
                 output_text = code_elem.get_text()
                 # Check if this looks like R console output (starts with ##)
@@ -47,6 +66,10 @@ def extract_r_outputs_from_html(html_file):
     
     return outputs
 
+def normalize_code(code):
+    """Collapse all whitespace runs so code compares independent of layout"""
+    return ' '.join(code.split())
+
 def add_outputs_to_ptx(ptx_file, outputs):
     """Add console outputs after matching program blocks in PTX file"""
     with open(ptx_file, 'r', encoding='utf-8') as f:
@@ -56,60 +79,110 @@ def add_outputs_to_ptx(ptx_file, outputs):
     new_lines = []
     i = 0
     
-    while i < len(lines):
-        new_lines.append(lines[i])
+    # Normalize each output's code once (remove extra whitespace), keeping
+    # the first output seen for any given code
+    outputs_by_code = {}
+    for output_info in outputs:
+        output_code_normalized = normalize_code(output_info['code'])
+        outputs_by_code.setdefault(output_code_normalized, output_info['output'])
+    
+    # Stream the result to a temporary file and swap it in at the end
+    tmp_file = ptx_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        separator = ''
+        
+        # Line index of the most recent program block start
+        program_start = None
         
-        # Check if this is a program closing tag
-        if lines[i].strip() == '</program>':
-            # Extract the R code from the previous program block
-            # Go back to find the start of the program block
-            j = i - 1
-            program_lines = []
-            while j >= 0:
-                if '<program language="r">' in lines[j]:
-                    # Found start, collect all lines between start and end
-                    for k in range(j, i + 1):
-                        program_lines.append(lines[k])
-                    break
-                j -= 1
+        while i < len(lines):
+            new_lines.append(lines[i])
             
-            # Extract the actual R code content
-            program_text = '\n'.join(program_lines)
+            if '<program language="r">' in lines[i]:
+                program_start = i
             
-            # Extract code from CDATA section
-            code_match = re.search(r'<input><!\[CDATA\[(.*?)\]\]></input>', program_text, re.DOTALL)
-            if code_match:
-                r_code = code_match.group(1).strip()
+            # Check if this is a program closing tag
+            elif lines[i].strip() == '</program>' and program_start is not None:
+                # Extract the actual R code content from the program block
+                program_text = '\n'.join(lines[program_start:i + 1])
                 
-                # Find matching output
-                for output_info in outputs:
-                    # Normalize code for comparison (remove extra whitespace)
-                    output_code_normalized = ' '.join(output_info['code'].split())
-                    r_code_normalized = ' '.join(r_code.split())
+                # Extract code from CDATA section (fixed delimiters, so plain
+                # string searches are enough)
+                code_start = program_text.find(CDATA_OPEN)
+                code_end = -1
+                if code_start != -1:
+                    code_start += len(CDATA_OPEN)
+                    code_end = program_text.find(CDATA_CLOSE, code_start)
+                if code_end != -1:
+                    r_code_normalized = normalize_code(program_text[code_start:code_end])
                     
-                    if output_code_normalized in r_code_normalized or r_code_normalized in output_code_normalized:
+                    # Find matching output: exact match first, then fall back to
+                    # a substring match in either direction
+                    output_text = outputs_by_code.get(r_code_normalized)
+                    if output_text is None:
+                        for output_code_normalized, text in outputs_by_code.items():
+                            if output_code_normalized in r_code_normalized or r_code_normalized in output_code_normalized:
+                                output_text = text
+                                break
+                    
+                    if output_text is not None:
                         # Check if next non-empty line is already a console block
                         k = i + 1
                         while k < len(lines) and not lines[k].strip():
                             k += 1
                         
-                        if k < len(lines) and '<console>' in lines[k]:
-                            # Already has output, skip
-                            break
-                        
-                        # Add the console output
-                        new_lines.append('    <console>')
-                        new_lines.append('      <output><![CDATA[')
-                        new_lines.append(output_info['output'])
-                        new_lines.append(']]></output>')
-                        new_lines.append('    </console>')
-                        break
+                        # Add the console output unless one is already there
+                        if not (k < len(lines) and '<console>' in lines[k]):
+                            new_lines.append('    <console>')
+                            new_lines.append('      <output><![CDATA[')
+                            new_lines.append(output_text)
+                            new_lines.append(']]></output>')
+                            new_lines.append('    </console>')
+            
+            # Write out in batches instead of joining the whole document
+            if len(new_lines) >= 1024:
+                f.write(separator)
+                f.write('\n'.join(new_lines))
+                separator = '\n'
+                new_lines = []
+            
+            i += 1
+        
+        if new_lines:
+            f.write(separator)
+            f.write('\n'.join(new_lines))
+    
+    os.replace(tmp_file, ptx_file)
+
+def process_chapters(ptx_name, html_names):
+    """Add the outputs of the given HTML chapters to one PTX file, returning the log lines"""
+    log = []
+    for html_name in html_names:
+        html_file = f'/home/runner/work/rbook/rbook/docs/book/{html_name}'
+        ptx_file = f'/home/runner/work/rbook/rbook/pretext/source/{ptx_name}'
+        
+        # Check if both files exist
+        if not os.path.exists(html_file):
+            log.append(f"Skipping {html_name}: HTML file not found")
+            continue
+        if not os.path.exists(ptx_file):
+            log.append(f"Skipping {html_name}: PTX file {ptx_name} not found")
+            continue
         
-        i += 1
+        log.append(f"\nProcessing {html_name} -> {ptx_name}...")
+        log.append(f"Extracting R outputs from {html_file}...")
+        outputs = extract_r_outputs_from_html(html_file)
+        
+        if len(outputs) == 0:
+            log.append(f"No R outputs found, skipping...")
+            continue
+            
+        log.append(f"Found {len(outputs)} R code outputs")
+        
+        log.append(f"Adding outputs to {ptx_file}...")
+        add_outputs_to_ptx(ptx_file, outputs)
+        log.append("Done!")
     
-    # Write back
-    with open(ptx_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(new_lines))
+    return log
 
 def main():
     import sys
@@ -136,31 +209,17 @@ def main():
             ('ttest.html', 'ch-hypothesistesting.ptx'),
         ]
         
+        # Several chapters share a PTX file, so group them by target: the
+        # groups are independent and run in parallel, while the chapters
+        # within a group are applied one after another
+        chapters_by_ptx = {}
         for html_name, ptx_name in chapters:
-            html_file = f'/home/runner/work/rbook/rbook/docs/book/{html_name}'
-            ptx_file = f'/home/runner/work/rbook/rbook/pretext/source/{ptx_name}'
-            
-            # Check if both files exist
-            if not os.path.exists(html_file):
-                print(f"Skipping {html_name}: HTML file not found")
-                continue
-            if not os.path.exists(ptx_file):
-                print(f"Skipping {html_name}: PTX file {ptx_name} not found")
-                continue
-            
-            print(f"\nProcessing {html_name} -> {ptx_name}...")
-            print(f"Extracting R outputs from {html_file}...")
-            outputs = extract_r_outputs_from_html(html_file)
-            
-            if len(outputs) == 0:
-                print(f"No R outputs found, skipping...")
-                continue
-                
-            print(f"Found {len(outputs)} R code outputs")
-            
-            print(f"Adding outputs to {ptx_file}...")
-            add_outputs_to_ptx(ptx_file, outputs)
-            print("Done!")
+            chapters_by_ptx.setdefault(ptx_name, []).append(html_name)
+        
+        max_workers = min(len(chapters_by_ptx), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for log in executor.map(process_chapters, chapters_by_ptx.keys(), chapters_by_ptx.values()):
+                print('\n'.join(log))
     else:
         html_file = sys.argv[1]
         ptx_file = sys.argv[2]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Convert every chapter handled by the convert_ch*.py scripts to PreTeXt XML.
+The chapters are independent of each other, so each one is converted in its
+own worker process.
+"""
+
+import contextlib
+import importlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Converter module, Rmd source in bookdown/, PTX output in pretext/source/
+CHAPTERS = [
+    ('convert_ch5_complete', '03.05-descriptives.Rmd', 'ch5-descriptive-statistics.ptx'),
+    ('convert_ch4_statistical_theory', '04.09-probability.Rmd', 'ch-probability.ptx'),
+    ('convert_ch4_statistical_theory', '04.10-estimation.Rmd', 'ch-estimation.ptx'),
+    ('convert_ch4_statistical_theory', '04.11-hypothesistesting.Rmd', 'ch-hypothesistesting.ptx'),
+    ('convert_ch_regression', '05.15-regression.Rmd', 'ch-regression.ptx'),
+    ('convert_ch5_anova2', '05.16-anova2.Rmd', 'ch5-factorial-anova.ptx'),
+    ('convert_ch6_bayes', '06.17-bayes.Rmd', 'ch6-bayesian-statistics.ptx'),
+]
+
+def convert_chapter(module_name, rmd_name, ptx_name):
+    """Convert one chapter, returning everything the converter printed"""
+    input_file = os.path.join(ROOT, 'bookdown', rmd_name)
+    output_file = os.path.join(ROOT, 'pretext', 'source', ptx_name)
+    module = importlib.import_module(module_name)
+    
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        if hasattr(module, 'RmdToPreTeXt'):
+            module.RmdToPreTeXt().convert(input_file, output_file)
+        else:
+            module.convert_rmd_to_pretext(input_file, output_file)
+    return log.getvalue()
+
+def main():
+    max_workers = min(len(CHAPTERS), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        logs = executor.map(convert_chapter, *zip(*CHAPTERS))
+        for (module_name, rmd_name, ptx_name), log in zip(CHAPTERS, logs):
+            print(f"[{module_name}] {rmd_name} -> {ptx_name}")
+            print(log, end='')
+    
+    print("All conversions complete!")
+
+if __name__ == '__main__':
+    main()
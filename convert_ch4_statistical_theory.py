@@ -6,12 +6,64 @@ Conversion of Part IV (Statistical theory) chapters from RMD to PreTeXt XML form
 - 04.11-hypothesistesting.Rmd (508 lines) → ch-hypothesistesting.ptx
 """
 
+import contextlib
+import io
+import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 class RmdToPreTeXt:
+    # Spans protected from the markdown passes, found in one left-to-right
+    # scan: an escaped \$ (literal currency), `code`, $$display$$ and $inline$
+    # math. An escaped \$ never delimits math. Each alternative has exactly
+    # one named group, which lastgroup reports, and starts with a literal so
+    # the scan can skip straight to the next '\\', '`' or '$'.
+    _RE_PROTECTED = re.compile(
+        r'\\(?P<dollar>\$)'
+        r'|`(?P<code>[^`]+)`'
+        r'|\$\$(?P<display_math>(?:\\\$|\\(?!\$)|[^\\])+?)\$\$'
+        r'|\$(?!\$)(?P<inline_math>[^$\\]*(?:\\(?:\$|(?!\$))[^$\\]*)*)\$',
+        re.DOTALL)
+    # Protected spans are stood in for by NUL-delimited indexes, which can
+    # never occur in Rmd source
+    _RE_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+    
+    # Inline formatting
+    # Bold + italic, bold and italic in one pass; every form becomes <em>.
+    # At each position the first alternative wins, so ***x*** is never read
+    # as **x** wrapped in stray asterisks. ___x___ keeps its inner _x_ so
+    # that it nests as <em><em>x</em></em>, as separate passes made it.
+    _RE_EMPHASIS = re.compile(
+        r'\*\*\*(?P<bold_italic>.+?)\*\*\*'
+        r'|\*\*_(?P<bold_und_italic>.+?)_\*\*'
+        r'|_\*\*(?P<und_bold_italic>.+?)\*\*_'
+        r'|\*\*(?P<bold>.+?)\*\*'
+        r'|__(?P<und_bold_und_italic>_[^_]+?_)__(?![_\w])'
+        r'|__(?P<und_bold>.+?)__'
+        r'|\*(?P<italic>(?:[^*]|\*\*[^*]+\*\*)+)\*'
+        r'|(?<![_\w])_(?P<und_italic>[^_]+?)_(?![_\w])')
+    _RE_XREF = re.compile(r'\\@ref\(([^)]+)\)')
+    _RE_FOOTNOTE = re.compile(r'\^\[([^\]]+)\]')
+    
+    # Block structure
+    # The title takes whitespace a whole run at a time, so the trailing \s*$
+    # is not retried from every position inside a long run of spaces
+    _RE_HEADING = re.compile(r'^(#{1,4})\s+((?:\s+|\S)+?)(?:\{#([^}]+)\})?\s*$')
+    # A bullet fills group 2 and a number leaves it empty
+    _RE_LIST = re.compile(r'^(\s*)(?:([-*+])|\d+\.)\s+(.+)$')
+    _RE_CHUNK_OPTION = re.compile(r'([\w.]+)\s*=\s*([^,}\s]+)')
+    
+    # Division tag by heading level (number of #'s)
+    _SECTION_TAGS = (None, 'chapter', 'section', 'subsection', 'subsubsection')
+    
     def __init__(self):
-        self.output = []
+        self.reset()
+    
+    def reset(self):
+        """Clear all per-file state so the converter can be reused"""
+        self.out = None
+        self.line_count = 0
         self.in_code_block = False
         self.code_block_lines = []
         self.code_block_params = {}
@@ -24,101 +76,116 @@ class RmdToPreTeXt:
         self.blockquote_lines = []
         self.section_stack = []
         
-    def escape_xml_text(self, text):
+    def emit(self, *lines):
+        """Write lines of XML straight to the output file"""
+        if not lines:
+            return
+        if self.line_count:
+            self.out.write('\n')
+        self.out.write('\n'.join(lines))
+        self.line_count += len(lines)
+    
+    @staticmethod
+    def escape_xml_text(text):
         """Escape XML special characters in regular text"""
+        # Most prose has nothing to escape; skip the three scans for it
+        if '&' not in text and '<' not in text and '>' not in text:
+            return text
         text = text.replace('&', '&amp;')
         text = text.replace('<', '&lt;')
         text = text.replace('>', '&gt;')
         return text
     
-    def convert_inline_formatting(self, text, escape=True):
-        """Convert inline formatting - call BEFORE escaping XML"""
-        # Protect escaped dollar signs (literal currency) FIRST
-        text = text.replace(r'\$', '~~~LITERALDOLLAR~~~')
-        
-        # Protect code blocks temporarily
-        code_parts = []
-        def save_code(match):
-            code_parts.append(match.group(1))
-            return f"~~~CODE{len(code_parts)-1}~~~"
-        text = re.sub(r'`([^`]+)`', save_code, text)
-        
-        # Convert display math $$...$$ to <me>...</me>
-        math_display_parts = []
-        def save_display_math(match):
-            content = match.group(1).strip()
-            # Use CDATA for LaTeX content to avoid XML parsing issues
-            if '&' in content or '<' in content or '>' in content or '\\begin' in content:
-                math_display_parts.append(f'<me><![CDATA[{content}]]></me>')
+    @classmethod
+    def protect_spans(cls, text, protected):
+        """Render literal dollars, code and math into protected, leaving placeholders"""
+        def protect(match):
+            kind = match.lastgroup
+            content = match.group(kind).replace(r'\$', '$')
+            if kind == 'dollar':
+                protected.append(content)
+            elif kind == 'code':
+                protected.append(f'<c>{cls.escape_xml_text(content)}</c>')
+            elif kind == 'display_math':
+                content = content.strip()
+                # Use CDATA for LaTeX content to avoid XML parsing issues
+                if '&' in content or '<' in content or '>' in content or '\\begin' in content:
+                    protected.append(f'<me><![CDATA[{content}]]></me>')
+                else:
+                    protected.append(f'<me>{content}</me>')
             else:
-                math_display_parts.append(f'<me>{content}</me>')
-            return f"~~~DISPMATH{len(math_display_parts)-1}~~~"
-        text = re.sub(r'\$\$(.+?)\$\$', save_display_math, text, flags=re.DOTALL)
+                # Use CDATA for complex LaTeX
+                if '&' in content or '<' in content or '>' in content:
+                    protected.append(f'<m><![CDATA[{content}]]></m>')
+                else:
+                    protected.append(f'<m>{content}</m>')
+            return f'\x00{len(protected) - 1}\x00'
+        return cls._RE_PROTECTED.sub(protect, text)
+    
+    @classmethod
+    def convert_inline_formatting(cls, text, escape=True):
+        """Convert inline formatting - call BEFORE escaping XML"""
+        # Most text has no markup at all, and then only escaping applies
+        if ('$' not in text and '`' not in text and '*' not in text and '_' not in text
+                and '\\@ref(' not in text and '^[' not in text):
+            return cls.escape_xml_text(text) if escape else text
         
-        # Convert inline math $...$ to <m>...</m>
-        math_parts = []
-        def save_inline_math(match):
-            content = match.group(1)
-            # Use CDATA for complex LaTeX
-            if '&' in content or '<' in content or '>' in content:
-                math_parts.append(f'<m><![CDATA[{content}]]></m>')
-            else:
-                math_parts.append(f'<m>{content}</m>')
-            return f"~~~MATH{len(math_parts)-1}~~~"
-        text = re.sub(r'\$([^\$]+?)\$', save_inline_math, text)
+        # Protect literal dollars, code and math
+        protected = []
+        if '$' in text or '`' in text:
+            text = cls.protect_spans(text, protected)
         
         # Escape XML AFTER protecting math and code
         if escape:
-            text = self.escape_xml_text(text)
+            text = cls.escape_xml_text(text)
         
         # Convert markdown formatting
-        # Bold + italic: ***text*** or **_text_** or _**text**_ 
-        text = re.sub(r'\*\*\*(.+?)\*\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'\*\*_(.+?)_\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'_\*\*(.+?)\*\*_', r'<em>\1</em>', text)
-        
-        # Bold: **text** or __text__
-        text = re.sub(r'\*\*(.+?)\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'__(.+?)__', r'<em>\1</em>', text)
-        
-        # Italic: *text* or _text_
-        text = re.sub(r'\*([^\*]+?)\*', r'<em>\1</em>', text)
-        text = re.sub(r'(?<![_\w])_([^_]+?)_(?![_\w])', r'<em>\1</em>', text)
+        text = cls.convert_emphasis(text)
         
         # Cross-references: \@ref(id) -> <xref ref="id"/>
-        text = re.sub(r'\\@ref\(([^)]+)\)', r'<xref ref="\1"/>', text)
+        if '\\@ref(' in text:
+            text = cls._RE_XREF.sub(r'<xref ref="\1"/>', text)
         
-        # Footnotes: ^[text] -> <fn>text</fn>
+        # Footnotes: ^[text] -> <fn>text</fn>. The body was escaped and
+        # formatted along with the rest of the text; only backticks and
+        # dollars that pair up differently within it are left to handle.
+        # Its spans go in the same list, so placeholder indexes stay unique.
         def convert_footnote(match):
             content = match.group(1)
-            content = self.convert_inline_formatting(content, escape=False)
-            return f'<fn>{content}</fn>'
-        text = re.sub(r'\^\[([^\]]+)\]', convert_footnote, text)
+            if '$' in content or '`' in content:
+                content = cls.protect_spans(content, protected)
+            return f'<fn>{cls.convert_emphasis(content)}</fn>'
+        if '^[' in text:
+            text = cls._RE_FOOTNOTE.sub(convert_footnote, text)
         
-        # Restore display math
-        for i, math in enumerate(math_display_parts):
-            text = text.replace(f"~~~DISPMATH{i}~~~", math)
-        
-        # Restore inline math
-        for i, math in enumerate(math_parts):
-            text = text.replace(f"~~~MATH{i}~~~", math)
-        
-        # Restore code blocks
-        for i, code in enumerate(code_parts):
-            text = text.replace(f"~~~CODE{i}~~~", f'<c>{self.escape_xml_text(code)}</c>')
-        
-        # Restore literal dollar signs
-        text = text.replace('~~~LITERALDOLLAR~~~', '$')
+        # Restore every protected span in one pass. A footnote body can pair
+        # the paragraph's backticks differently, leaving placeholders inside
+        # a protected span, so those are restored too.
+        def restore(match):
+            span = protected[int(match.group(1))]
+            if '\x00' in span:
+                span = cls._RE_PLACEHOLDER.sub(restore, span)
+            return span
+        if protected:
+            text = cls._RE_PLACEHOLDER.sub(restore, text)
         
         return text
     
+    @classmethod
+    def convert_emphasis(cls, text):
+        """Convert markdown bold/italic to <em>, including nested emphasis"""
+        if '*' not in text and '_' not in text:
+            return text
+        return cls._RE_EMPHASIS.sub(
+            lambda m: f'<em>{cls.convert_emphasis(m.group(m.lastgroup))}</em>', text)
+    
     def flush_paragraph(self):
         """Output accumulated paragraph"""
         if self.paragraph_lines:
-            content = ' '.join(self.paragraph_lines).strip()
-            if content:
-                content = self.convert_inline_formatting(content)
-                self.output.append(f'<p>{content}</p>')
+            # The lines were stripped and are never blank, so neither is this
+            content = ' '.join(self.paragraph_lines)
+            content = self.convert_inline_formatting(content)
+            self.emit(f'<p>{content}</p>')
             self.paragraph_lines = []
             self.in_paragraph = False
     
@@ -126,11 +193,9 @@ class RmdToPreTeXt:
         """Output accumulated list"""
         if self.list_lines:
             tag = 'ul' if self.list_type == 'ul' else 'ol'
-            self.output.append(f'<{tag}>')
-            for item in self.list_lines:
-                item = self.convert_inline_formatting(item)
-                self.output.append(f'<li><p>{item}</p></li>')
-            self.output.append(f'</{tag}>')
+            items = [f'<li><p>{self.convert_inline_formatting(item)}</p></li>'
+                     for item in self.list_lines]
+            self.emit(f'<{tag}>', *items, f'</{tag}>')
             self.list_lines = []
             self.list_type = None
             self.in_list = False
@@ -138,11 +203,11 @@ class RmdToPreTeXt:
     def flush_blockquote(self):
         """Output accumulated blockquote"""
         if self.blockquote_lines:
-            self.output.append('<blockquote>')
-            content = ' '.join(self.blockquote_lines).strip()
+            content = ' '.join(self.blockquote_lines)
             content = self.convert_inline_formatting(content)
-            self.output.append(f'<p>{content}</p>')
-            self.output.append('</blockquote>')
+            self.emit('<blockquote>',
+                      f'<p>{content}</p>',
+                      '</blockquote>')
             self.blockquote_lines = []
             self.in_blockquote = False
     
@@ -159,19 +224,19 @@ class RmdToPreTeXt:
                 
                 if echo == 'FALSE' or eval_param == 'FALSE':
                     # This is output or a table
-                    self.output.append('<console>')
-                    self.output.append(f'<output><![CDATA[{code}]]></output>')
-                    self.output.append('</console>')
+                    self.emit('<console>',
+                              f'<output><![CDATA[{code}]]></output>',
+                              '</console>')
                 else:
                     # Regular R code
-                    self.output.append('<program language="r">')
-                    self.output.append(f'<input><![CDATA[{code}]]></input>')
-                    self.output.append('</program>')
+                    self.emit('<program language="r">',
+                              f'<input><![CDATA[{code}]]></input>',
+                              '</program>')
             else:
                 # Plain text or other language
-                self.output.append('<console>')
-                self.output.append(f'<output><![CDATA[{code}]]></output>')
-                self.output.append('</console>')
+                self.emit('<console>',
+                          f'<output><![CDATA[{code}]]></output>',
+                          '</console>')
             
             self.code_block_lines = []
             self.code_block_params = {}
@@ -181,7 +246,7 @@ class RmdToPreTeXt:
         """Close sections down to target level"""
         while self.section_stack and self.section_stack[-1][0] >= target_level:
             _, tag = self.section_stack.pop()
-            self.output.append(f'</{tag}>')
+            self.emit(f'</{tag}>')
     
     def process_line(self, line):
         """Process a single line"""
@@ -197,15 +262,14 @@ class RmdToPreTeXt:
                 # Parse code block parameters
                 params_str = line[3:].strip()
                 if params_str.startswith('{'):
-                    # R code block with parameters
-                    params_str = params_str[1:-1] if params_str.endswith('}') else params_str[1:]
-                    parts = params_str.split(',')
+                    # R code block with parameters; everything before the
+                    # first comma is the engine and label, then key=value
+                    # options follow
                     self.code_block_params['lang'] = 'r'
-                    for part in parts[1:]:
-                        part = part.strip()
-                        if '=' in part:
-                            key, val = part.split('=', 1)
-                            self.code_block_params[key.strip()] = val.strip()
+                    comma = params_str.find(',')
+                    if comma >= 0:
+                        self.code_block_params.update(
+                            self._RE_CHUNK_OPTION.findall(params_str, comma + 1))
                 elif params_str:
                     self.code_block_params['lang'] = params_str
                 
@@ -216,16 +280,24 @@ class RmdToPreTeXt:
             self.code_block_lines.append(line)
             return
         
+        # Every branch below looks at the stripped line, so strip it once
+        stripped = line.strip()
+        
+        # Only lines starting with '#' can be headings and only lines starting
+        # with a bullet, digit or whitespace can be list items, so each regex
+        # runs just for the lines that could match it
+        first = line[:1]
+        
         # Handle chapter/section headings
-        heading_match = re.match(r'^(#{1,4})\s+(.+?)(?:\{#([^}]+)\})?\s*$', line)
+        heading_match = self._RE_HEADING.match(line) if first == '#' else None
         if heading_match:
             self.flush_paragraph()
             self.flush_list()
             self.flush_blockquote()
             
-            level = len(heading_match.group(1))
-            title = heading_match.group(2).strip()
-            xml_id = heading_match.group(3)
+            hashes, title, xml_id = heading_match.groups()
+            level = len(hashes)
+            title = title.strip()
             
             # Convert inline formatting in title
             title = self.convert_inline_formatting(title)
@@ -233,22 +305,10 @@ class RmdToPreTeXt:
             # Close deeper sections
             self.close_sections(level)
             
-            # Determine tag
-            if level == 1:
-                tag = 'chapter'
-            elif level == 2:
-                tag = 'section'
-            elif level == 3:
-                tag = 'subsection'
-            else:
-                tag = 'subsubsection'
-            
             # Open new section
-            if xml_id:
-                self.output.append(f'<{tag} xml:id="{xml_id}">')
-            else:
-                self.output.append(f'<{tag}>')
-            self.output.append(f'<title>{title}</title>')
+            tag = self._SECTION_TAGS[level]
+            open_tag = f'<{tag} xml:id="{xml_id}">' if xml_id else f'<{tag}>'
+            self.emit(open_tag, f'<title>{title}</title>')
             self.section_stack.append((level, tag))
             return
         
@@ -262,25 +322,26 @@ class RmdToPreTeXt:
                 self.blockquote_lines.append(content)
             self.in_blockquote = True
             return
-        elif self.in_blockquote and line.strip():
-            # Continuation of blockquote content
-            self.blockquote_lines.append(line.strip())
-            return
-        elif self.in_blockquote and not line.strip():
-            self.flush_blockquote()
+        elif self.in_blockquote:
+            if stripped:
+                # Continuation of blockquote content
+                self.blockquote_lines.append(stripped)
+            else:
+                self.flush_blockquote()
             return
         
         # Handle lists
-        list_match = re.match(r'^(\s*)([-*+]|\d+\.)\s+(.+)$', line)
+        if first in ('-', '*', '+') or first.isdigit() or first.isspace():
+            list_match = self._RE_LIST.match(line)
+        else:
+            list_match = None
         if list_match:
             self.flush_paragraph()
             
-            indent = list_match.group(1)
-            marker = list_match.group(2)
-            content = list_match.group(3)
+            indent, bullet, content = list_match.groups()
             
             # Determine list type
-            new_list_type = 'ol' if marker[0].isdigit() else 'ul'
+            new_list_type = 'ul' if bullet else 'ol'
             
             # If switching list types, flush old list
             if self.in_list and self.list_type != new_list_type:
@@ -292,7 +353,7 @@ class RmdToPreTeXt:
             return
         
         # Empty line - flush current paragraph/list/blockquote
-        if not line.strip():
+        if not stripped:
             self.flush_paragraph()
             self.flush_list()
             self.flush_blockquote()
@@ -302,44 +363,47 @@ class RmdToPreTeXt:
         self.flush_list()
         self.flush_blockquote()
         
-        self.paragraph_lines.append(line.strip())
+        self.paragraph_lines.append(stripped)
         self.in_paragraph = True
     
     def convert(self, input_file, output_file):
         """Convert RMD file to PreTeXt XML"""
         print(f"Converting {input_file} to {output_file}...")
+        self.reset()
         
-        with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Add XML declaration
-        self.output.append('<?xml version="1.0" encoding="UTF-8"?>')
-        self.output.append('')
-        
-        # Process each line
-        for line in lines:
-            line = line.rstrip('\n')
-            self.process_line(line)
-        
-        # Flush any remaining content
-        self.flush_paragraph()
-        self.flush_list()
-        self.flush_blockquote()
-        self.flush_code_block()
-        
-        # Close all open sections
-        self.close_sections(0)
-        
-        # Write output
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(self.output))
+        # Stream the input line by line and the XML straight to the output
+        # file as it is generated
+        line_number = 0
+        with open(input_file, 'r', encoding='utf-8') as f, \
+             open(output_file, 'w', encoding='utf-8') as self.out:
+            # Add XML declaration
+            self.emit('<?xml version="1.0" encoding="UTF-8"?>', '')
+            
+            # Process each line
+            for line_number, line in enumerate(f, 1):
+                self.process_line(line.rstrip('\n'))
+            
+            # Flush any remaining content
+            self.flush_paragraph()
+            self.flush_list()
+            self.flush_blockquote()
+            self.flush_code_block()
+            
+            # Close all open sections
+            self.close_sections(0)
+        self.out = None
         
-        print(f"✓ Converted {len(lines)} lines to {output_file}")
-        return len(self.output)
+        print(f"✓ Converted {line_number} lines to {output_file}")
+        return self.line_count
+
+def convert_chapter(input_file, output_file):
+    """Convert one chapter, returning everything the converter printed"""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        RmdToPreTeXt().convert(input_file, output_file)
+    return log.getvalue()
 
 def main():
-    converter = RmdToPreTeXt()
-    
     chapters = [
         ('bookdown/04.09-probability.Rmd', 'pretext/source/ch-probability.ptx'),
         ('bookdown/04.10-estimation.Rmd', 'pretext/source/ch-estimation.ptx'),
@@ -351,10 +415,13 @@ def main():
     print("=" * 70)
     print()
     
-    for input_file, output_file in chapters:
-        converter = RmdToPreTeXt()  # Fresh converter for each file
-        lines = converter.convert(input_file, output_file)
-        print()
+    # The chapters share no state (no formatting is cached across them), so
+    # each is converted in its own process; logs are printed in chapter
+    # order once each conversion finishes
+    max_workers = min(len(chapters), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for log in executor.map(convert_chapter, *zip(*chapters)):
+            print(log)
     
     print("=" * 70)
     print("All conversions complete!")
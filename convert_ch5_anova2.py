@@ -4,73 +4,127 @@ Convert RMarkdown file to PreTeXt XML format.
 Converts bookdown/05.16-anova2.Rmd to PreTeXt XML.
 """
 
+import io
 import re
 import sys
 
+# Inline formatting, matched in a single pass. At each position the first
+# alternative wins, so code spans and math are never reformatted and $$...$$
+# is taken as display math before $...$ can split it; every alternative has
+# exactly one (named) group so lastgroup names the match.
+_RE_INLINE = re.compile(
+    r'(?P<code>(?<!`)`[^`]+`(?!`))'
+    r'|\\@ref\((?P<xref>[^)]+)\)'
+    r'|\$\$(?P<dmath>[^$]+)\$\$'
+    r'|(?<!\$)\$(?P<math>[^$]+)\$'
+    r'|\*\*\*(?P<bold3>[^*]+)\*\*\*'
+    r'|\*\*_(?P<bold_it>[^*_]+)_\*\*'
+    r'|\*\*(?P<bold>[^*]+)\*\*'
+    r'|_(?P<it_und>[^_]+)_'
+    r'|\*(?!\s)(?P<it_star>(?:[^*]|\*\*[^*]+\*\*)+)\*'
+    r'|\^\[(?P<fn>[^\]]+)\]'
+)
+
+# Line classification: which block construct (if any) a stripped line opens
+_RE_LINE_KIND = re.compile(
+    r'(?P<chapter># )|(?P<heading>##)|(?P<rcode>```\{r)'
+    r'|(?P<env>\\begin\{)|(?P<dmath>\$\$)'
+)
+
+# Indent strings for the usual nesting depths (## to ######); deeper
+# headings, which _RE_HASHES also accepts, build theirs on the fly
+_INDENT = tuple('  ' * depth for depth in range(8))
+
+# Heading patterns
+_RE_CHAPTER = re.compile(r'#\s+([^{]+)\{#([^}]+)\}')
+_RE_HASHES = re.compile(r'^#+')
+_RE_SECTION_ID = re.compile(r'#+\s+([^{]+)\{#([^}]+)\}')
+_RE_SECTION = re.compile(r'#+\s+(.+)$')
+
 def process_inline_formatting(text, in_code=False):
     """Convert markdown inline formatting to PreTeXt."""
     if in_code:
         return text
     
-    # Handle cross-references \@ref(id) -> <xref ref="id"/>
-    text = re.sub(r'\\@ref\(([^)]+)\)', r'<xref ref="\1"/>', text)
+    search = _RE_INLINE.search
+    if search(text) is None:
+        return text
     
-    # Handle inline math $...$ -> <m>...</m>
-    # But be careful not to match display math
-    parts = []
-    i = 0
-    while i < len(text):
-        if text[i] == '$' and (i == 0 or text[i-1] != '$') and (i+1 < len(text) and text[i+1] != '$'):
-            # Find closing $
-            j = i + 1
-            while j < len(text) and text[j] != '$':
-                j += 1
-            if j < len(text):
-                math_content = text[i+1:j]
-                parts.append('<m>' + math_content + '</m>')
-                i = j + 1
-                continue
-        parts.append(text[i])
-        i += 1
-    text = ''.join(parts)
-    
-    # Handle **bold** and _text_ first (including **_text_**)
-    text = re.sub(r'\*\*_([^*_]+)_\*\*', r'<em>\1</em>', text)
-    # Handle **text** 
-    text = re.sub(r'\*\*([^*]+)\*\*', r'<em>\1</em>', text)
-    # Handle _text_
-    text = re.sub(r'_([^_]+)_', r'<em>\1</em>', text)
-    # Handle *text*
-    text = re.sub(r'\*([^*\s][^*]*)\*', r'<em>\1</em>', text)
-    
-    # Handle footnotes ^[...] -> <fn>...</fn>
-    def replace_footnote(match):
-        content = match.group(1)
-        content = process_inline_formatting(content, in_code=False)
-        return f'<fn>{content}</fn>'
-    text = re.sub(r'\^\[([^\]]+)\]', replace_footnote, text)
-    
-    return text
+    # Footnote and emphasis bodies are formatted too. Rather than recursing,
+    # each body gets its own frame [parts, source, position, closing tag]
+    # and is scanned to the end before its parent resumes.
+    result = []
+    stack = [[result, text, 0, None]]
+    while stack:
+        frame = stack[-1]
+        parts, source, pos, closing = frame
+        match = search(source, pos)
+        if match is None:
+            parts.append(source[pos:])
+            stack.pop()
+            if closing is not None:
+                stack[-1][0].append(''.join(parts) + closing)
+            continue
+        
+        parts.append(source[pos:match.start()])
+        frame[2] = match.end()
+        kind = match.lastgroup
+        content = match.group(kind)
+        if kind == 'code':
+            # Inline code is kept as-is
+            parts.append(content)
+        elif kind == 'xref':
+            # \@ref(id) -> <xref ref="id"/>
+            parts.append(f'<xref ref="{content}"/>')
+        elif kind == 'dmath':
+            # $$...$$ inside a paragraph -> <me>...</me>
+            parts.append(f'<me><![CDATA[{content.strip()}]]></me>')
+        elif kind == 'math':
+            # $...$ -> <m>...</m>
+            parts.append(f'<m>{content}</m>')
+        elif kind == 'fn':
+            # ^[...] -> <fn>...</fn>
+            parts.append('<fn>')
+            stack.append([[], content, 0, '</fn>'])
+        elif kind == 'bold3':
+            # ***text*** is both bold and italic
+            parts.append('<em><em>')
+            stack.append([[], content, 0, '</em></em>'])
+        else:
+            # **_text_**, **text**, _text_ and *text* -> <em>...</em>
+            parts.append('<em>')
+            stack.append([[], content, 0, '</em>'])
+    
+    return ''.join(result)
 
 def convert_rmd_to_pretext(input_file, output_file):
     """Main conversion function."""
     
     with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+        lines = f.read().splitlines()
+    
+    # Strip every line once up front; the raw lines are only needed for code
+    stripped_lines = [line.strip() for line in lines]
     
-    output = []
-    output.append('<?xml version="1.0" encoding="UTF-8" ?>\n\n')
+    buf = io.StringIO()
+    buf.write('<?xml version="1.0" encoding="UTF-8" ?>\n\n')
     
     i = 0
     in_r_code = False
     r_code_buffer = []
     para_buffer = []
     
-    # Track section depth
+    # Track section depth; the indent and paragraph opener only change when
+    # the stack does, so they are recomputed there rather than per block
     section_stack = []
+    indent = _INDENT[1]
+    open_p = indent + '  <p>'
     
-    def get_indent():
-        return '  ' * (len(section_stack) + 1)
+    def update_indent():
+        nonlocal indent, open_p
+        depth = len(section_stack) + 1
+        indent = _INDENT[depth] if depth < len(_INDENT) else '  ' * depth
+        open_p = indent + '  <p>'
     
     def flush_paragraph():
         """Flush the paragraph buffer to output."""
@@ -78,44 +132,45 @@ def convert_rmd_to_pretext(input_file, output_file):
         if para_buffer:
             content = ' '.join(para_buffer)
             content = process_inline_formatting(content)
-            indent = get_indent()
-            output.append(f'{indent}  <p>{content}</p>\n')
+            buf.writelines((open_p, content, '</p>\n'))
             para_buffer = []
     
     while i < len(lines):
         line = lines[i]
-        stripped = line.strip()
+        stripped = stripped_lines[i]
+        match = _RE_LINE_KIND.match(stripped)
+        kind = match.lastgroup if match else None
         
         # Handle chapter title
-        if stripped.startswith('# ') and i == 0:
-            match = re.match(r'#\s+([^{]+)\{#([^}]+)\}', stripped)
+        if kind == 'chapter' and i == 0:
+            match = _RE_CHAPTER.match(stripped)
             if match:
                 title = match.group(1).strip()
                 xml_id = match.group(2)
-                output.append(f'<chapter xml:id="{xml_id}">\n')
-                output.append(f'  <title>{title}</title>\n\n')
+                buf.writelines((f'<chapter xml:id="{xml_id}">\n',
+                                f'  <title>{title}</title>\n\n'))
             i += 1
             continue
         
         # Handle section headers
-        if stripped.startswith('##'):
+        if kind == 'heading':
             flush_paragraph()
             
             # Close previous sections as needed
-            level = len(re.match(r'^#+', stripped).group(0))
+            level = len(_RE_HASHES.match(stripped).group(0))
             
             while section_stack and section_stack[-1] >= level:
                 section_stack.pop()
-                indent = get_indent()
+                update_indent()
                 if section_stack or level > 2:
-                    output.append(f'{indent}</subsection>\n')
+                    buf.write(f'{indent}</subsection>\n')
                 else:
-                    output.append(f'{indent}</section>\n')
+                    buf.write(f'{indent}</section>\n')
             
             # Open new section
-            match = re.match(r'#+\s+([^{]+)\{#([^}]+)\}', stripped)
+            match = _RE_SECTION_ID.match(stripped)
             if not match:
-                match = re.match(r'#+\s+(.+)$', stripped)
+                match = _RE_SECTION.match(stripped)
                 if match:
                     title = match.group(1).strip()
                     # Process title for inline formatting  
@@ -129,25 +184,16 @@ def convert_rmd_to_pretext(input_file, output_file):
                 title = process_inline_formatting(title)
                 xml_id = match.group(2)
             
-            indent = get_indent()
-            if level == 2:
-                if xml_id:
-                    output.append(f'{indent}<section xml:id="{xml_id}">\n')
-                else:
-                    output.append(f'{indent}<section>\n')
-                output.append(f'{indent}  <title>{title}</title>\n\n')
-            else:
-                if xml_id:
-                    output.append(f'{indent}<subsection xml:id="{xml_id}">\n')
-                else:
-                    output.append(f'{indent}<subsection>\n')
-                output.append(f'{indent}  <title>{title}</title>\n\n')
+            tag = 'section' if level == 2 else 'subsection'
+            id_attr = f' xml:id="{xml_id}"' if xml_id else ''
+            buf.write(f'{indent}<{tag}{id_attr}>\n{indent}  <title>{title}</title>\n\n')
             section_stack.append(level)
+            update_indent()
             i += 1
             continue
         
         # Handle R code blocks
-        if stripped.startswith('```{r') or stripped == '```{r}':
+        if kind == 'rcode':
             flush_paragraph()
             in_r_code = True
             r_code_buffer = []
@@ -158,15 +204,9 @@ def convert_rmd_to_pretext(input_file, output_file):
             if stripped == '```':
                 # End of R code block
                 in_r_code = False
-                code_content = ''.join(r_code_buffer)
-                indent = get_indent()
-                output.append(f'{indent}  <program language="r">\n')
-                output.append(f'{indent}    <input><![CDATA[\n')
-                output.append(code_content)
-                if not code_content.endswith('\n'):
-                    output.append('\n')
-                output.append(f'{indent}    ]]></input>\n')
-                output.append(f'{indent}  </program>\n')
+                code_content = '\n'.join(r_code_buffer)
+                buf.write(f'{indent}  <program language="r">\n{indent}    <input><![CDATA[\n'
+                          f'{code_content}\n{indent}    ]]></input>\n{indent}  </program>\n')
                 r_code_buffer = []
             else:
                 r_code_buffer.append(line)
@@ -174,13 +214,13 @@ def convert_rmd_to_pretext(input_file, output_file):
             continue
         
         # Handle LaTeX environments like \begin{center}
-        if stripped.startswith('\\begin{'):
+        if kind == 'env':
             flush_paragraph()
             # Skip these environments - they're typically for formatting
             i += 1
-            while i < len(lines) and not lines[i].strip().startswith('\\end{'):
+            while i < len(lines) and not stripped_lines[i].startswith('\\end{'):
                 # Capture the content
-                content_line = lines[i].strip()
+                content_line = stripped_lines[i]
                 if content_line and not content_line.startswith('\\'):
                     # It's code or content, keep it in paragraph
                     para_buffer.append(content_line)
@@ -189,11 +229,10 @@ def convert_rmd_to_pretext(input_file, output_file):
             continue
         
         # Handle display math $$...$$ on single line
-        if stripped.startswith('$$') and stripped.endswith('$$') and len(stripped) > 4:
+        if kind == 'dmath' and stripped.endswith('$$') and len(stripped) > 4:
             flush_paragraph()
             math_content = stripped[2:-2].strip()
-            indent = get_indent()
-            output.append(f'{indent}  <me><![CDATA[{math_content}]]></me>\n')
+            buf.write(f'{indent}  <me><![CDATA[{math_content}]]></me>\n')
             i += 1
             continue
         
@@ -203,13 +242,12 @@ def convert_rmd_to_pretext(input_file, output_file):
             # Collect math content
             i += 1
             math_lines = []
-            while i < len(lines) and lines[i].strip() != '$$':
+            while i < len(lines) and stripped_lines[i] != '$$':
                 math_lines.append(lines[i].rstrip())
                 i += 1
             
             math_content = '\n'.join(math_lines)
-            indent = get_indent()
-            output.append(f'{indent}  <me><![CDATA[\n{math_content}\n{indent}  ]]></me>\n')
+            buf.write(f'{indent}  <me><![CDATA[\n{math_content}\n{indent}  ]]></me>\n')
             i += 1
             continue
         
@@ -229,20 +267,22 @@ def convert_rmd_to_pretext(input_file, output_file):
     # Close all open sections
     while section_stack:
         level = section_stack.pop()
-        indent = get_indent()
+        update_indent()
         if level == 2:
-            output.append(f'{indent}</section>\n')
+            buf.write(f'{indent}</section>\n')
         else:
-            output.append(f'{indent}</subsection>\n')
+            buf.write(f'{indent}</subsection>\n')
     
-    output.append('</chapter>\n')
+    buf.write('</chapter>\n')
     
     # Write output
+    text = buf.getvalue()
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.writelines(output)
+        f.write(text)
     
     print(f"Conversion complete: {output_file}")
-    print(f"Total lines in output: {len(output)}")
+    line_count = text.count('\n')
+    print(f"Total lines in output: {line_count}")
 
 if __name__ == '__main__':
     input_file = '/home/runner/work/rbook/rbook/bookdown/05.16-anova2.Rmd'
@@ -4,12 +4,61 @@ Complete and accurate conversion of 03.05-descriptives.Rmd to PreTeXt XML format
 Handles all 1374 lines with proper structure and fixes all critical issues
 """
 
+import io
+import itertools
 import re
 import sys
 
 class RmdToPreTeXt:
+    # Inline markup, matched in a single left-to-right pass. At each position
+    # the first alternative wins, so code and math are never reformatted and
+    # $$...$$ is tried before $...$; an escaped \$ is a literal dollar sign
+    # and never delimits math. Each alternative has exactly one named group,
+    # which lastgroup reports. Every alternative starts with a literal
+    # character (lookbehinds come after it) so the scanner can skip straight
+    # to candidate positions instead of trying each alternative everywhere.
+    _RE_INLINE = re.compile(
+        r'\\(?P<dollar>\$)'
+        r'|`(?P<code>[^`]+)`'
+        r'|\$\$(?P<dmath>(?:\\.|[^\\])*?)\$\$'
+        r'|\$(?P<imath>(?:\\.|[^$\\])+)\$'
+        r'|\*\*\*(?P<term>[^*]+)\*\*\*'
+        r'|\*\*_(?P<term_und>[^_]+)_\*\*'
+        r'|\*\*(?P<bold>[^*]+)\*\*'
+        r'|\*(?<!\S\*)(?P<ital>(?:[^*]|\*\*[^*]+\*\*)+)\*(?!\S)'
+        r'|-(?<= -)(?P<mdash>-)(?= )',
+        re.DOTALL)
+    _RE_FOOTNOTE = re.compile(r'\^\[(.+?)\](?!\()')
+    # NUL never occurs in Rmd source, so a saved footnote's placeholder
+    # cannot collide with the text or be touched by the inline markup
+    _RE_FOOTNOTE_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+    
+    # Cross-references, in one pass. A "Chapter "/"Section " prefix is
+    # consumed with the reference; "Figure "/"Table " only with fig:/tab: ones.
+    # The named group says which ref prefix to add.
+    _RE_XREF = re.compile(
+        r'(?:Figure )?\\@ref\(fig:(?P<fig>[^)]+)\)'
+        r'|(?:Table )?\\@ref\(tab:(?P<tab>[^)]+)\)'
+        r'|(?:Chapter |Section )?\\@ref\((?P<ref>[^)]+)\)')
+    _XREF_PREFIXES = {'fig': 'fig-', 'tab': 'table-', 'ref': ''}
+    
+    # Block structure
+    _RE_FENCE = re.compile(r'```\{r\s*([^}]*)\}')
+    _RE_UL = re.compile(r'^(\s*)[-*]\s+(.+)$')
+    _RE_OL = re.compile(r'^(\s*)\d+\.\s+(.+)$')
+    
+    # Code chunks
+    _RE_INCLUDE_GRAPHICS = re.compile(r'include_graphics\(["\']([^"\']+)["\']\)')
+    _RE_FIGCAP = re.compile(r'fig\.cap\s*=\s*"((?:[^"\\]|\\.)*)"')
+    _RE_PARAM_SPLIT = re.compile(r',\s*(?![^()]*\))')
+    
     def __init__(self):
-        self.output = []
+        self.out = None
+        self.reset()
+    
+    def reset(self):
+        """Clear all per-file state so the converter can be reused"""
+        self.line_count = 0
         self.in_code_block = False
         self.code_block_lines = []
         self.code_block_params = {}
@@ -21,101 +70,80 @@ class RmdToPreTeXt:
         self.in_blockquote = False
         self.blockquote_lines = []
         self.section_stack = []
+        # '  ' per open section; recomputed only when the stack changes
+        self.base_indent = ''
         
+    def emit(self, *lines):
+        """Write lines of XML straight to the output file"""
+        if not lines:
+            return
+        if self.line_count:
+            self.out.write('\n')
+        self.out.write('\n'.join(lines))
+        self.line_count += len(lines)
+    
     def escape_xml_text(self, text):
         """Escape XML special characters in regular text"""
+        # Most prose has nothing to escape; skip the three scans for it
+        if '&' not in text and '<' not in text and '>' not in text:
+            return text
         text = text.replace('&', '&amp;')
         text = text.replace('<', '&lt;')
         text = text.replace('>', '&gt;')
         return text
     
-    def convert_inline_formatting(self, text, escape=True):
-        """Convert inline formatting - call BEFORE escaping XML"""
-        # Protect escaped dollar signs (literal currency) FIRST
-        text = text.replace(r'\$', '___LITERAL_DOLLAR___')
-        
-        # Protect code blocks temporarily
-        code_parts = []
-        def save_code(match):
-            code_parts.append(match.group(1))
-            return f"__CODE_{len(code_parts)-1}__"
-        text = re.sub(r'`([^`]+)`', save_code, text)
-        
-        # Protect and CONVERT LaTeX math temporarily
-        math_parts = []
-        def save_display_math(match):
-            # Convert $$...$$ to <me>...</me> immediately
-            content = match.group(1)
-            math_parts.append(f'<me>{content}</me>')
-            return f"__MATH_{len(math_parts)-1}__"
-        def save_inline_math(match):
-            # Convert $...$ to <m>...</m> immediately
-            content = match.group(1)
-            math_parts.append(f'<m>{content}</m>')
-            return f"__MATH_{len(math_parts)-1}__"
-        
-        # Display math $$...$$ first
-        text = re.sub(r'\$\$(.*?)\$\$', save_display_math, text, flags=re.DOTALL)
-        # Inline math $...$ 
-        text = re.sub(r'\$([^$]+)\$', save_inline_math, text)
-        
-        # Now escape XML if needed
-        if escape:
-            text = self.escape_xml_text(text)
-        
-        # Convert ***term*** and **_term_** to <term>
-        text = re.sub(r'\*\*\*([^*]+)\*\*\*', r'<term>\1</term>', text)
-        text = re.sub(r'\*\*_([^_]+)_\*\*', r'<term>\1</term>', text)
-        
-        # Convert **bold** to <em>
-        text = re.sub(r'\*\*([^*]+)\*\*', r'<em>\1</em>', text)
-        
-        # Convert *italics* (at start of line or after space) to <em>
-        text = re.sub(r'(^|\s)\*([^*]+)\*($|\s)', r'\1<em>\2</em>\3', text)
-        
-        # Convert -- to <mdash />
-        text = text.replace(' -- ', ' <mdash /> ')
-        
-        # Restore code as <c>code</c>
-        for i, code in enumerate(code_parts):
-            text = text.replace(f"__CODE_{i}__", f'<c>{code}</c>')
-        
-        # Restore literal dollar signs as plain dollar signs
-        text = text.replace('___LITERAL_DOLLAR___', '$')
-        
-        # Restore math (now already converted to <m> and <me> tags)
-        for i, math in enumerate(math_parts):
-            text = text.replace(f"__MATH_{i}__", math)
+    def format_inline_markup(self, text, escape=True):
+        """Convert code, math and emphasis in one scan, escaping the text between them"""
+        # Every alternative needs one of these characters; plain prose has none
+        if '$' not in text and '*' not in text and '`' not in text and '--' not in text:
+            return self.escape_xml_text(text) if escape else text
+        
+        parts = []
+        pos = 0
+        for match in self._RE_INLINE.finditer(text):
+            plain = text[pos:match.start()]
+            parts.append(self.escape_xml_text(plain) if escape else plain)
+            pos = match.end()
+            
+            kind = match.lastgroup
+            content = match.group(kind)
+            if kind in ('code', 'dmath', 'imath'):
+                # Escaped dollar signs (literal currency) are plain dollars
+                content = content.replace(r'\$', '$')
+            
+            if kind == 'dollar':
+                parts.append('$')
+            elif kind == 'code':
+                parts.append(f'<c>{content}</c>')
+            elif kind == 'dmath':
+                parts.append(f'<me>{content}</me>')
+            elif kind == 'imath':
+                parts.append(f'<m>{content}</m>')
+            elif kind == 'mdash':
+                parts.append('<mdash />')
+            elif kind in ('term', 'term_und'):
+                # ***term*** and **_term_** -> <term>
+                parts.append(f'<term>{self.format_inline_markup(content, escape)}</term>')
+            else:
+                # **bold** and *italics* -> <em>
+                parts.append(f'<em>{self.format_inline_markup(content, escape)}</em>')
         
-        return text
-    
-    def convert_math(self, text):
-        """Convert math notation - NO-OP since math is already converted in convert_inline_formatting"""
-        # Math is now converted inline during convert_inline_formatting
-        # This function is kept for compatibility but does nothing
-        return text
+        plain = text[pos:]
+        parts.append(self.escape_xml_text(plain) if escape else plain)
+        return ''.join(parts)
     
     def convert_cross_refs(self, text):
         """Convert cross-references"""
-        # Chapter/Section at start
-        text = re.sub(r'Chapter \\@ref\(([^)]+)\)', 
-                     lambda m: f'<xref ref="{m.group(1).replace("_", "-")}" />', text)
-        text = re.sub(r'Section \\@ref\(([^)]+)\)', 
-                     lambda m: f'<xref ref="{m.group(1).replace("_", "-")}" />', text)
-        # Figure references
-        text = re.sub(r'Figure \\@ref\(fig:([^)]+)\)', 
-                     lambda m: f'<xref ref="fig-{m.group(1).replace("_", "-")}" />', text)
-        text = re.sub(r'\\@ref\(fig:([^)]+)\)', 
-                     lambda m: f'<xref ref="fig-{m.group(1).replace("_", "-")}" />', text)
-        # Table references
-        text = re.sub(r'Table \\@ref\(tab:([^)]+)\)', 
-                     lambda m: f'<xref ref="table-{m.group(1).replace("_", "-")}" />', text)
-        text = re.sub(r'\\@ref\(tab:([^)]+)\)', 
-                     lambda m: f'<xref ref="table-{m.group(1).replace("_", "-")}" />', text)
-        # Generic references
-        text = re.sub(r'\\@ref\(([^)]+)\)', 
-                     lambda m: f'<xref ref="{m.group(1).replace("_", "-")}" />', text)
-        return text
+        # Every reference needs \@ref( - most text has none
+        if '\\@ref(' not in text:
+            return text
+        return self._RE_XREF.sub(self.replace_cross_ref, text)
+    
+    def replace_cross_ref(self, match):
+        """Replace one \\@ref() match with its <xref>"""
+        kind = match.lastgroup
+        ref = match.group(kind).replace('_', '-')
+        return f'<xref ref="{self._XREF_PREFIXES[kind]}{ref}" />'
     
     def process_text_line(self, text):
         """Process all inline conversions"""
@@ -124,22 +152,27 @@ class RmdToPreTeXt:
         def save_footnote(match):
             fn_content = match.group(1)
             # Process footnote content with inline formatting
-            fn_content = self.convert_inline_formatting(fn_content, escape=False)
+            fn_content = self.format_inline_markup(fn_content, escape=False)
             footnote_parts.append(f'<fn>{fn_content}</fn>')
-            return f"__FOOTNOTE_{len(footnote_parts)-1}__"
+            return f"\x00{len(footnote_parts)-1}\x00"
         
         # Match footnotes with a greedy approach - find ^[ and match until the last ]
-        # This handles cases like ^[text $math](more)$ text]
-        text = re.sub(r'\^\[(.+?)\](?!\()', save_footnote, text)
+        # This handles cases like ^[text $math](more)$ text]. The lazy scan is
+        # skipped outright for the many fragments that contain no footnote.
+        if '^[' in text:
+            text = self._RE_FOOTNOTE.sub(save_footnote, text)
         
         # Now process the rest
-        text = self.convert_inline_formatting(text)
-        text = self.convert_math(text)  # No-op but kept for compatibility
+        text = self.format_inline_markup(text)
         text = self.convert_cross_refs(text)
         
-        # Restore footnotes
-        for i, fn in enumerate(footnote_parts):
-            text = text.replace(f"__FOOTNOTE_{i}__", fn)
+        # Restore all footnotes in one pass
+        def restore_footnote(match):
+            index = int(match.group(1))
+            return footnote_parts[index] if index < len(footnote_parts) else match.group(0)
+        
+        if footnote_parts:
+            text = self._RE_FOOTNOTE_PLACEHOLDER.sub(restore_footnote, text)
         
         return text
     
@@ -148,24 +181,23 @@ class RmdToPreTeXt:
         if self.paragraph_lines:
             para_text = ' '.join(self.paragraph_lines)
             para_text = self.process_text_line(para_text)
-            indent = '  ' * (len(self.section_stack) + 1)
-            self.output.append(f'{indent}<p>')
-            self.output.append(f'{indent}  {para_text}')
-            self.output.append(f'{indent}</p>')
+            indent = self.base_indent + '  '
+            self.emit(indent + '<p>', indent + '  ' + para_text, indent + '</p>')
             self.paragraph_lines = []
         self.in_paragraph = False
     
     def flush_list(self):
         """Output accumulated list"""
         if self.list_lines:
-            indent = '  ' * (len(self.section_stack) + 1)
-            self.output.append(f'{indent}<{self.list_type}>')
+            indent = self.base_indent + '  '
+            self.emit(f'{indent}<{self.list_type}>')
+            li_open = indent + '  <li>'
+            li_close = indent + '  </li>'
+            p_open = indent + '    <p>'
             for item in self.list_lines:
                 item_text = self.process_text_line(item)
-                self.output.append(f'{indent}  <li>')
-                self.output.append(f'{indent}    <p>{item_text}</p>')
-                self.output.append(f'{indent}  </li>')
-            self.output.append(f'{indent}</{self.list_type}>')
+                self.emit(li_open, p_open + item_text + '</p>', li_close)
+            self.emit(f'{indent}</{self.list_type}>')
             self.list_lines = []
         self.in_list = False
         self.list_type = None
@@ -175,10 +207,10 @@ class RmdToPreTeXt:
         if self.blockquote_lines:
             quote_text = ' '.join(self.blockquote_lines)
             quote_text = self.process_text_line(quote_text)
-            indent = '  ' * (len(self.section_stack) + 1)
-            self.output.append(f'{indent}<blockquote>')
-            self.output.append(f'{indent}  <p>{quote_text}</p>')
-            self.output.append(f'{indent}</blockquote>')
+            indent = self.base_indent + '  '
+            self.emit(indent + '<blockquote>',
+                      indent + '  <p>' + quote_text + '</p>',
+                      indent + '</blockquote>')
             self.blockquote_lines = []
         self.in_blockquote = False
     
@@ -186,8 +218,30 @@ class RmdToPreTeXt:
         """Close sections down to target level"""
         while len(self.section_stack) > target_level:
             section_info = self.section_stack.pop()
-            indent = '  ' * (len(self.section_stack) + 1)
-            self.output.append(f'{indent}</{section_info["type"]}>')
+            self.base_indent = '  ' * len(self.section_stack)
+            self.emit(f'{self.base_indent}  </{section_info["type"]}>')
+    
+    def split_heading(self, line):
+        """Split an rstripped '## Title {#id}' line into (level, title, id)"""
+        # One to four #'s, then whitespace, then a non-empty title
+        level = len(line) - len(line.lstrip('#'))
+        if not 1 <= level <= 4:
+            return None
+        start = len(line) - len(line[level:].lstrip())
+        if start == level or start == len(line):
+            return None
+        
+        # A trailing {#id} is the earliest {# after the title's first
+        # character whose id runs to the closing brace without another }
+        xml_id = None
+        end = len(line)
+        if line.endswith('}'):
+            brace = line.rfind('}', 0, -1)
+            at = line.find('{#', max(start + 1, brace - 1), len(line) - 2)
+            if at != -1:
+                xml_id = line[at + 2:-1]
+                end = at
+        return level, line[start:end].strip(), xml_id
     
     def process_heading(self, line):
         """Process markdown heading with CORRECT nesting"""
@@ -195,17 +249,13 @@ class RmdToPreTeXt:
         self.flush_list()
         self.flush_blockquote()
         
-        match = re.match(r'^(#{1,4})\s+(.+?)(?:\{#([^}]+)\})?\s*$', line)
-        if not match:
+        heading = self.split_heading(line)
+        if not heading:
             return
-        
-        level = len(match.group(1))
-        title = match.group(2).strip()
-        xml_id = match.group(3) if match.group(3) else None
+        level, title, xml_id = heading
         
         # Process title formatting
-        title = self.convert_inline_formatting(title, escape=False)
-        # Math is already converted in convert_inline_formatting, no need to call convert_math
+        title = self.format_inline_markup(title, escape=False)
         
         if level == 1:
             # Chapter title - already handled
@@ -227,15 +277,16 @@ class RmdToPreTeXt:
         self.close_sections_to_level(target_level - 1)
         
         # Add new section
-        indent = '  ' * len(self.section_stack)
+        indent = self.base_indent
         if xml_id:
             xml_id = xml_id.replace('_', '-')
-            self.output.append(f'{indent}  <{section_type} xml:id="{xml_id}">')
+            self.emit(f'{indent}  <{section_type} xml:id="{xml_id}">')
         else:
-            self.output.append(f'{indent}  <{section_type}>')
-        self.output.append(f'{indent}    <title>{title}</title>')
+            self.emit(f'{indent}  <{section_type}>')
+        self.emit(f'{indent}    <title>{title}</title>')
         
         self.section_stack.append({'type': section_type, 'level': target_level})
+        self.base_indent = '  ' * len(self.section_stack)
     
     def process_figure_caption(self, caption):
         """Process figure caption - handle escaped quotes and truncation"""
@@ -260,60 +311,52 @@ class RmdToPreTeXt:
         fig_cap = params.get('fig.cap', '')
         echo = params.get('echo', True)
         label = params.get('label', '')
-        include_graphics = None
-        
-        # Check if this is an include_graphics call
-        code_text = '\n'.join(self.code_block_lines)
-        graphics_match = re.search(r'include_graphics\(["\']([^"\']+)["\']\)', code_text)
-        if graphics_match:
-            include_graphics = graphics_match.group(1)
-        
-        indent = '  ' * len(self.section_stack)
-        
-        # Escape XML in code lines
-        escaped_code_lines = [self.escape_xml_text(line) for line in self.code_block_lines]
+        indent = self.base_indent
         
         # If there's a figure caption, create a figure
         if fig_cap:
-            fig_id = f'fig-{label}' if label else ''
-            if fig_id:
-                self.output.append(f'{indent}  <figure xml:id="{fig_id}">')
-            else:
-                self.output.append(f'{indent}  <figure>')
-            
+            fig_open = f'<figure xml:id="fig-{label}">' if label else '<figure>'
             caption = self.process_figure_caption(fig_cap)
-            self.output.append(f'{indent}    <caption>{caption}</caption>')
             
-            # Determine image source
-            if include_graphics:
-                image_src = include_graphics.replace('./img/', 'images/')
+            # Determine image source. Only figures use it, and most figure
+            # chunks draw a plot rather than call include_graphics, so the
+            # regex runs only when the call is actually there.
+            graphics_match = None
+            if any('include_graphics(' in line for line in self.code_block_lines):
+                code_text = '\n'.join(self.code_block_lines)
+                graphics_match = self._RE_INCLUDE_GRAPHICS.search(code_text)
+            if graphics_match:
+                image_src = graphics_match.group(1).replace('./img/', 'images/')
             elif label:
                 image_src = f'generated/{label}.png'
             else:
                 image_src = 'generated/plot.png'
             
-            self.output.append(f'{indent}    <image source="{image_src}"/>')
-            self.output.append(f'{indent}  </figure>')
+            self.emit(f'{indent}  {fig_open}',
+                      f'{indent}    <caption>{caption}</caption>',
+                      f'{indent}    <image source="{image_src}"/>',
+                      f'{indent}  </figure>')
             
-            # Add R code in a remark if echo != FALSE
+            # Add R code in a remark if echo != FALSE, escaping XML in the
+            # code lines as they are indented
             if echo and echo != 'FALSE':
-                self.output.append(f'{indent}  <remark>')
-                self.output.append(f'{indent}    <title>R Code</title>')
-                self.output.append(f'{indent}    <program language="r">')
-                self.output.append(f'{indent}      <input>')
-                for line in escaped_code_lines:
-                    self.output.append(f'{indent}        {line}')
-                self.output.append(f'{indent}      </input>')
-                self.output.append(f'{indent}    </program>')
-                self.output.append(f'{indent}  </remark>')
+                code_indent = indent + '        '
+                self.emit(f'{indent}  <remark>',
+                          f'{indent}    <title>R Code</title>',
+                          f'{indent}    <program language="r">',
+                          f'{indent}      <input>',
+                          *[code_indent + self.escape_xml_text(line) for line in self.code_block_lines],
+                          f'{indent}      </input>',
+                          f'{indent}    </program>',
+                          f'{indent}  </remark>')
         else:
             # Regular code block
-            self.output.append(f'{indent}  <program language="r">')
-            self.output.append(f'{indent}    <input>')
-            for line in escaped_code_lines:
-                self.output.append(f'{indent}      {line}')
-            self.output.append(f'{indent}    </input>')
-            self.output.append(f'{indent}  </program>')
+            code_indent = indent + '      '
+            self.emit(f'{indent}  <program language="r">',
+                      f'{indent}    <input>',
+                      *[code_indent + self.escape_xml_text(line) for line in self.code_block_lines],
+                      f'{indent}    </input>',
+                      f'{indent}  </program>')
         
         self.code_block_lines = []
         self.code_block_params = {}
@@ -323,15 +366,19 @@ class RmdToPreTeXt:
         params = {}
         
         # Handle fig.cap specially - it can span to end of line and contain escaped quotes
-        fig_cap_match = re.search(r'fig\.cap\s*=\s*"((?:[^"\\]|\\.)*)"', params_str)
+        fig_cap_match = self._RE_FIGCAP.search(params_str)
         if fig_cap_match:
             params['fig.cap'] = fig_cap_match.group(1)
             # Remove fig.cap from params_str for further processing
             params_str = params_str[:fig_cap_match.start()] + params_str[fig_cap_match.end():]
         
         # Now parse remaining parameters
-        # Split by comma, but be careful
-        parts = re.split(r',\s*(?![^()]*\))', params_str)
+        # Split by comma, but be careful. Without a ')' the lookahead can never
+        # fail, so a plain split gives the same parts (they are stripped below)
+        if ')' in params_str:
+            parts = self._RE_PARAM_SPLIT.split(params_str)
+        else:
+            parts = params_str.split(',')
         
         for j, part in enumerate(parts):
             part = part.strip()
@@ -348,37 +395,61 @@ class RmdToPreTeXt:
     
     def convert(self, input_file, output_file):
         """Main conversion function"""
-        with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        # Stream the source line by line and the XML to the output file as
+        # it is generated. Trailing whitespace is never significant, so it
+        # is stripped (with the newline) as each line is read.
+        with open(input_file, 'r', encoding='utf-8') as f, \
+             open(output_file, 'w', encoding='utf-8') as self.out:
+            self.convert_lines(line.rstrip() for line in f)
+        self.out = None
+        
+        print(f"Conversion complete: {output_file}")
+        print(f"Generated {self.line_count} lines of XML")
+    
+    def convert_string(self, rmd_text):
+        """Convert Rmd source text, returning the XML as a string"""
+        lines = (line.rstrip() for line in rmd_text.splitlines())
+        
+        # Same emitters as convert(), but into one growing in-memory buffer
+        self.out = io.StringIO()
+        try:
+            self.convert_lines(lines)
+            return self.out.getvalue()
+        finally:
+            self.out = None
+    
+    def convert_lines(self, lines):
+        """Convert an iterable of Rmd source lines, emitting the whole chapter"""
+        # self.out is set by the caller; everything else starts fresh
+        self.reset()
         
         # Start XML document
-        self.output.append('<?xml version="1.0" encoding="UTF-8" ?>')
-        self.output.append('')
-        self.output.append('<chapter xml:id="ch5-descriptive-statistics">')
-        self.output.append('  <title>Descriptive statistics</title>')
+        self.emit('<?xml version="1.0" encoding="UTF-8" ?>')
+        self.emit('')
+        self.emit('<chapter xml:id="ch5-descriptive-statistics">')
+        self.emit('  <title>Descriptive statistics</title>')
         
-        i = 0
         skip_yaml = False
         
-        while i < len(lines):
-            line = lines[i].rstrip()
+        # Each line is paired with the one after it (None at the end), the
+        # only lookahead the list handling needs
+        for line, next_line in itertools.pairwise(itertools.chain(lines, (None,))):
+            # Lines arrive rstripped, so only leading whitespace is left
+            stripped = line.lstrip()
+            # Block syntax is recognised by its first character, so compare
+            # that instead of running startswith() for every construct
+            lead = line[:1]
+            first = stripped[:1]
             
             # Skip YAML header
-            if line.strip() == '---':
-                if not skip_yaml:
-                    skip_yaml = True
-                    i += 1
-                    continue
-                else:
-                    skip_yaml = False
-                    i += 1
-                    continue
+            if stripped == '---':
+                skip_yaml = not skip_yaml
+                continue
             if skip_yaml:
-                i += 1
                 continue
             
             # Handle code blocks
-            if line.strip().startswith('```'):
+            if first == '`' and stripped.startswith('```'):
                 if not self.in_code_block:
                     # Starting code block
                     self.flush_paragraph()
@@ -389,7 +460,7 @@ class RmdToPreTeXt:
                     self.code_block_lines = []
                     
                     # Parse code block parameters
-                    code_match = re.match(r'```\{r\s*([^}]*)\}', line)
+                    code_match = self._RE_FENCE.match(line)
                     if code_match:
                         params_str = code_match.group(1).strip()
                         self.code_block_params = self.parse_code_block_params(params_str)
@@ -398,24 +469,25 @@ class RmdToPreTeXt:
                     self.in_code_block = False
                     self.process_code_block()
                 
-                i += 1
                 continue
             
             if self.in_code_block:
                 self.code_block_lines.append(line)
-                i += 1
                 continue
             
             # Handle headings
-            if line.startswith('#'):
+            if lead == '#':
                 self.process_heading(line)
-                i += 1
                 continue
             
             # Handle blockquotes
-            if line.startswith('>'):
-                self.flush_paragraph()
-                self.flush_list()
+            if lead == '>':
+                # The in_* flags say whether anything is buffered, so the
+                # flushes are skipped on every line of an ongoing quote
+                if self.in_paragraph:
+                    self.flush_paragraph()
+                if self.in_list:
+                    self.flush_list()
                 
                 if not self.in_blockquote:
                     self.in_blockquote = True
@@ -424,17 +496,18 @@ class RmdToPreTeXt:
                 quote_text = line[1:].strip()
                 if quote_text:
                     self.blockquote_lines.append(quote_text)
-                i += 1
                 continue
             else:
                 if self.in_blockquote:
                     self.flush_blockquote()
             
-            # Handle lists
-            list_match = re.match(r'^(\s*)[-*]\s+(.+)$', line)
+            # Handle lists. A list item can only start with a bullet or a
+            # digit, so other lines skip both list regexes.
+            list_match = self._RE_UL.match(line) if first in ('-', '*') else None
             if list_match:
-                self.flush_paragraph()
-                self.flush_blockquote()
+                # Any blockquote was flushed just above
+                if self.in_paragraph:
+                    self.flush_paragraph()
                 
                 if not self.in_list:
                     self.in_list = True
@@ -443,14 +516,13 @@ class RmdToPreTeXt:
                 
                 item_text = list_match.group(2)
                 self.list_lines.append(item_text)
-                i += 1
                 continue
             
             # Numbered lists
-            num_list_match = re.match(r'^(\s*)\d+\.\s+(.+)$', line)
+            num_list_match = self._RE_OL.match(line) if first.isdigit() else None
             if num_list_match:
-                self.flush_paragraph()
-                self.flush_blockquote()
+                if self.in_paragraph:
+                    self.flush_paragraph()
                 
                 if not self.in_list:
                     self.in_list = True
@@ -459,27 +531,31 @@ class RmdToPreTeXt:
                 
                 item_text = num_list_match.group(2)
                 self.list_lines.append(item_text)
-                i += 1
                 continue
             
             # If we had a list, check if it continues
-            if self.in_list and not line.strip():
+            if self.in_list and not stripped:
                 # Empty line might end list, but check next line
-                if i + 1 < len(lines):
-                    next_line = lines[i + 1].rstrip()
-                    if not re.match(r'^(\s*)[-*]\s+', next_line) and not re.match(r'^(\s*)\d+\.\s+', next_line):
+                if next_line is not None:
+                    next_first = next_line.lstrip()[:1]
+                    if next_first in ('-', '*'):
+                        continues = self._RE_UL.match(next_line)
+                    elif next_first.isdigit():
+                        continues = self._RE_OL.match(next_line)
+                    else:
+                        continues = None
+                    if not continues:
                         self.flush_list()
                 else:
                     self.flush_list()
-            elif self.in_list and line.strip():
+            elif self.in_list and stripped:
                 # Non-empty, non-list line ends the list
                 self.flush_list()
             
             # Handle blank lines
-            if not line.strip():
+            if not stripped:
                 if self.in_paragraph:
                     self.flush_paragraph()
-                i += 1
                 continue
             
             # Regular paragraph text
@@ -488,9 +564,7 @@ class RmdToPreTeXt:
                     self.in_paragraph = True
                     self.paragraph_lines = []
                 
-                self.paragraph_lines.append(line.strip())
-            
-            i += 1
+                self.paragraph_lines.append(stripped)
         
         # Flush any remaining content
         self.flush_paragraph()
@@ -501,18 +575,14 @@ class RmdToPreTeXt:
         self.close_sections_to_level(0)
         
         # Close chapter
-        self.output.append('</chapter>')
-        
-        # Write output
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(self.output))
-        
-        print(f"Conversion complete: {output_file}")
-        print(f"Generated {len(self.output)} lines of XML")
+        self.emit('</chapter>')
 
 def main():
-    input_file = '/home/runner/work/rbook/rbook/bookdown/03.05-descriptives.Rmd'
-    output_file = '/home/runner/work/rbook/rbook/pretext/source/ch5-descriptive-statistics.ptx'
+    if len(sys.argv) == 3:
+        input_file, output_file = sys.argv[1], sys.argv[2]
+    else:
+        input_file = '/home/runner/work/rbook/rbook/bookdown/03.05-descriptives.Rmd'
+        output_file = '/home/runner/work/rbook/rbook/pretext/source/ch5-descriptive-statistics.ptx'
     
     converter = RmdToPreTeXt()
     converter.convert(input_file, output_file)
@@ -8,11 +8,54 @@ import re
 import sys
 
 class RmdToPreTeXt:
+    # Spans protected from the markdown passes, found in one left-to-right
+    # scan: an escaped \$ (literal currency), `code`, $$display$$ and $inline$
+    # math. An escaped \$ never delimits math. Each alternative has exactly
+    # one named group, which lastgroup reports, and starts with a literal so
+    # the scan can skip straight to the next '\\', '`' or '$'.
+    _RE_PROTECTED = re.compile(
+        r'\\(?P<dollar>\$)'
+        r'|`(?P<code>[^`]+)`'
+        r'|\$\$(?P<display_math>(?:\\\$|\\(?!\$)|[^\\])+?)\$\$'
+        r'|\$(?!\$)(?P<inline_math>[^$\\]*(?:\\(?:\$|(?!\$))[^$\\]*)*)\$',
+        re.DOTALL)
+    # Protected spans are stood in for by NUL-delimited indexes, which can
+    # never occur in Rmd source
+    _RE_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+    
+    # Inline formatting
+    # Bold + italic, bold and italic in one pass; every form becomes <em>.
+    # At each position the first alternative wins, so ***x*** is never read
+    # as **x** wrapped in stray asterisks. ___x___ keeps its inner _x_ so
+    # that it nests as <em><em>x</em></em>, as separate passes made it.
+    _RE_EMPHASIS = re.compile(
+        r'\*\*\*(?P<bold_italic>.+?)\*\*\*'
+        r'|\*\*_(?P<bold_und_italic>.+?)_\*\*'
+        r'|_\*\*(?P<und_bold_italic>.+?)\*\*_'
+        r'|\*\*(?P<bold>.+?)\*\*'
+        r'|__(?P<und_bold_und_italic>_[^_]+?_)__(?![_\w])'
+        r'|__(?P<und_bold>.+?)__'
+        r'|\*(?P<italic>(?:[^*]|\*\*[^*]+\*\*)+)\*'
+        r'|(?<![_\w])_(?P<und_italic>[^_]+?)_(?![_\w])')
+    _RE_XREF = re.compile(r'\\@ref\(([^)]+)\)')
+    _RE_FOOTNOTE = re.compile(r'\^\[([^\]]+)\]')
+    
+    # Block structure
+    _RE_CHUNK_PARAMS = re.compile(r'```\{r\s+([^}]*)\}')
+    _RE_CHAPTER = re.compile(r'#\s+(.+?)\{#([^}]+)\}')
+    _RE_SECTION = re.compile(r'##\s+(.+?)(?:\{#([^}]+)\})?$')
+    _RE_SUBSECTION = re.compile(r'###\s+(.+?)(?:\{#([^}]+)\})?$')
+    _RE_LIST_START = re.compile(r'^[\*\-\d]')
+    
+    # Closing tag for each division left open at the end of the chapter
+    _CLOSING_TAGS = {'section': '  </section>', 'subsection': '    </subsection>'}
+    
     def __init__(self):
-        self.output = []
+        self.out = None
+        self.line_count = 0
         self.in_code_block = False
         self.code_block_lines = []
-        self.code_block_params = {}
+        self.code_block_is_output = False
         self.in_paragraph = False
         self.paragraph_lines = []
         self.in_list = False
@@ -22,100 +65,111 @@ class RmdToPreTeXt:
         self.blockquote_lines = []
         self.section_stack = []
         
+    def emit(self, *lines):
+        """Write lines of XML straight to the output file"""
+        if not lines:
+            return
+        if self.line_count:
+            self.out.write('\n')
+        self.out.write('\n'.join(lines))
+        self.line_count += len(lines)
+    
     def escape_xml_text(self, text):
         """Escape XML special characters in regular text"""
+        # Most prose has nothing to escape; skip the three scans for it
+        if '&' not in text and '<' not in text and '>' not in text:
+            return text
         text = text.replace('&', '&amp;')
         text = text.replace('<', '&lt;')
         text = text.replace('>', '&gt;')
         return text
     
+    def protect_spans(self, text, protected):
+        """Render literal dollars, code and math into protected, leaving placeholders"""
+        def protect(match):
+            kind = match.lastgroup
+            content = match.group(kind).replace(r'\$', '$')
+            if kind == 'dollar':
+                protected.append(content)
+            elif kind == 'code':
+                protected.append(f'<c>{content}</c>')
+            elif kind == 'display_math':
+                content = content.strip()
+                # Use CDATA for LaTeX content to avoid XML parsing issues
+                if '&' in content or '<' in content or '>' in content or '\\begin' in content:
+                    protected.append(f'<me><![CDATA[{content}]]></me>')
+                else:
+                    protected.append(f'<me>{content}</me>')
+            else:
+                # Use CDATA for complex LaTeX
+                if '&' in content or '<' in content or '>' in content:
+                    protected.append(f'<m><![CDATA[{content}]]></m>')
+                else:
+                    protected.append(f'<m>{content}</m>')
+            return f'\x00{len(protected) - 1}\x00'
+        return self._RE_PROTECTED.sub(protect, text)
+    
     def convert_inline_formatting(self, text, escape=True):
         """Convert inline formatting - call BEFORE escaping XML"""
-        # Protect escaped dollar signs (literal currency) FIRST
-        text = text.replace(r'\$', '___LITERAL_DOLLAR___')
-        
-        # Protect code blocks temporarily
-        code_parts = []
-        def save_code(match):
-            code_parts.append(match.group(1))
-            return f"~~~CODE{len(code_parts)-1}~~~"
-        text = re.sub(r'`([^`]+)`', save_code, text)
-        
-        # Convert display math $$...$$ to <me>...</me>
-        math_display_parts = []
-        def save_display_math(match):
-            content = match.group(1).strip()
-            # Use CDATA for LaTeX content to avoid XML parsing issues
-            if '&' in content or '<' in content or '>' in content or '\\begin' in content:
-                math_display_parts.append(f'<me><![CDATA[{content}]]></me>')
-            else:
-                math_display_parts.append(f'<me>{content}</me>')
-            return f"~~~DISPMATH{len(math_display_parts)-1}~~~"
-        text = re.sub(r'\$\$(.+?)\$\$', save_display_math, text, flags=re.DOTALL)
+        # Most text has no markup at all, and then only escaping applies
+        if ('$' not in text and '`' not in text and '*' not in text and '_' not in text
+                and '\\@ref(' not in text and '^[' not in text):
+            return self.escape_xml_text(text) if escape else text
         
-        # Convert inline math $...$ to <m>...</m>
-        math_parts = []
-        def save_inline_math(match):
-            content = match.group(1)
-            # Use CDATA for complex LaTeX
-            if '&' in content or '<' in content or '>' in content:
-                math_parts.append(f'<m><![CDATA[{content}]]></m>')
-            else:
-                math_parts.append(f'<m>{content}</m>')
-            return f"~~~MATH{len(math_parts)-1}~~~"
-        text = re.sub(r'\$([^\$]+?)\$', save_inline_math, text)
+        # Protect literal dollars, code and math
+        protected = []
+        if '$' in text or '`' in text:
+            text = self.protect_spans(text, protected)
         
         # Escape XML AFTER protecting math and code
         if escape:
             text = self.escape_xml_text(text)
         
         # Convert markdown formatting
-        # Bold + italic: ***text*** or **_text_** or _**text**_ 
-        text = re.sub(r'\*\*\*(.+?)\*\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'\*\*_(.+?)_\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'_\*\*(.+?)\*\*_', r'<em>\1</em>', text)
-        
-        # Bold: **text** or __text__
-        text = re.sub(r'\*\*(.+?)\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'__(.+?)__', r'<em>\1</em>', text)
-        
-        # Italic: *text* or _text_
-        text = re.sub(r'\*([^\*]+?)\*', r'<em>\1</em>', text)
-        text = re.sub(r'(?<![_\w])_([^_]+?)_(?![_\w])', r'<em>\1</em>', text)
+        text = self.convert_emphasis(text)
         
         # Cross-references: \@ref(id) -> <xref ref="id"/>
-        text = re.sub(r'\\@ref\(([^)]+)\)', r'<xref ref="\1"/>', text)
+        if '\\@ref(' in text:
+            text = self._RE_XREF.sub(r'<xref ref="\1"/>', text)
         
-        # Footnotes: ^[text] -> <fn>text</fn>
+        # Footnotes: ^[text] -> <fn>text</fn>. The body was escaped and
+        # formatted along with the rest of the text; only backticks and
+        # dollars that pair up differently within it are left to handle.
+        # Its spans go in the same list, so placeholder indexes stay unique.
         def convert_footnote(match):
             content = match.group(1)
-            content = self.convert_inline_formatting(content, escape=False)
-            return f'<fn>{content}</fn>'
-        text = re.sub(r'\^\[([^\]]+)\]', convert_footnote, text)
-        
-        # Restore display math
-        for i, math in enumerate(math_display_parts):
-            text = text.replace(f"~~~DISPMATH{i}~~~", math)
-        
-        # Restore inline math
-        for i, math in enumerate(math_parts):
-            text = text.replace(f"~~~MATH{i}~~~", math)
-        
-        # Restore code
-        for i, code in enumerate(code_parts):
-            text = text.replace(f"~~~CODE{i}~~~", f'<c>{code}</c>')
-        
-        # Restore literal dollar signs
-        text = text.replace('___LITERAL_DOLLAR___', '$')
+            if '$' in content or '`' in content:
+                content = self.protect_spans(content, protected)
+            return f'<fn>{self.convert_emphasis(content)}</fn>'
+        if '^[' in text:
+            text = self._RE_FOOTNOTE.sub(convert_footnote, text)
+        
+        # Restore every protected span in one pass. A footnote body can pair
+        # the paragraph's backticks differently, leaving placeholders inside
+        # a protected span, so those are restored too.
+        def restore(match):
+            span = protected[int(match.group(1))]
+            if '\x00' in span:
+                span = self._RE_PLACEHOLDER.sub(restore, span)
+            return span
+        if protected:
+            text = self._RE_PLACEHOLDER.sub(restore, text)
         
         return text
     
+    def convert_emphasis(self, text):
+        """Convert markdown bold/italic to <em>, including nested emphasis"""
+        if '*' not in text and '_' not in text:
+            return text
+        return self._RE_EMPHASIS.sub(
+            lambda m: f'<em>{self.convert_emphasis(m.group(m.lastgroup))}</em>', text)
+    
     def flush_paragraph(self):
         """Flush accumulated paragraph lines"""
         if self.paragraph_lines:
             content = ' '.join(self.paragraph_lines)
             content = self.convert_inline_formatting(content)
-            self.output.append(f"    <p>{content}</p>")
+            self.emit(f"    <p>{content}</p>")
             self.paragraph_lines = []
             self.in_paragraph = False
     
@@ -131,14 +185,12 @@ class RmdToPreTeXt:
             if len(parts) == 2:
                 text_part = parts[0].strip()
                 author_part = parts[1].strip()
-                self.output.append(f'    <blockquote>')
-                self.output.append(f'      <p>{text_part}</p>')
-                self.output.append(f'      <attribution>{author_part}</attribution>')
-                self.output.append(f'    </blockquote>')
+                self.emit('    <blockquote>',
+                          f'      <p>{text_part}</p>',
+                          f'      <attribution>{author_part}</attribution>',
+                          '    </blockquote>')
             else:
-                self.output.append(f'    <blockquote>')
-                self.output.append(f'      <p>{content}</p>')
-                self.output.append(f'    </blockquote>')
+                self.emit('    <blockquote>', f'      <p>{content}</p>', '    </blockquote>')
             
             self.blockquote_lines = []
             self.in_blockquote = False
@@ -149,13 +201,9 @@ class RmdToPreTeXt:
             return
         
         list_tag = 'ul' if self.list_type == 'unordered' else 'ol'
-        self.output.append(f"    <{list_tag}>")
-        
-        for item in self.list_lines:
-            content = self.convert_inline_formatting(item)
-            self.output.append(f"      <li><p>{content}</p></li>")
-        
-        self.output.append(f"    </{list_tag}>")
+        items = [f"      <li><p>{self.convert_inline_formatting(item)}</p></li>"
+                 for item in self.list_lines]
+        self.emit(f"    <{list_tag}>", *items, f"    </{list_tag}>")
         self.list_lines = []
         self.in_list = False
         self.list_type = None
@@ -164,58 +212,78 @@ class RmdToPreTeXt:
         """Flush accumulated code block"""
         if self.code_block_lines:
             # Check if it's an output block
-            is_output = self.code_block_params.get('output', False)
-            
-            # Join code lines
-            code_content = '\n'.join(self.code_block_lines)
+            is_output = self.code_block_is_output
             
+            # Each block is written in one call, code lines included
             if is_output:
                 # Output blocks should use console element
-                self.output.append('    <console>')
-                self.output.append('      <output><![CDATA[')
-                self.output.append(code_content)
-                self.output.append(']]></output>')
-                self.output.append('    </console>')
+                self.emit('    <console>',
+                          '      <output><![CDATA[',
+                          *self.code_block_lines,
+                          ']]></output>',
+                          '    </console>')
             else:
                 # Use CDATA to avoid issues with < and & in code
-                self.output.append('    <program language="r">')
-                self.output.append('      <input><![CDATA[')
-                self.output.append(code_content)
-                self.output.append(']]></input>')
-                self.output.append('    </program>')
+                self.emit('    <program language="r">',
+                          '      <input><![CDATA[',
+                          *self.code_block_lines,
+                          ']]></input>',
+                          '    </program>')
             
             self.code_block_lines = []
             self.in_code_block = False
-            self.code_block_params = {}
+            self.code_block_is_output = False
+    
+    def split_list_item(self, line):
+        """Return (list type, item text) for a '* item' or '1. item' line, else None"""
+        # The marker must be followed by whitespace, which may be the line's
+        # trailing whitespace, so only the leading whitespace is dropped
+        body = line.lstrip()
+        if body[0] in '*-':
+            if body[1:2].isspace():
+                return 'unordered', body[1:].strip()
+            return None
+        
+        digits = 1
+        while body[digits:digits + 1].isdecimal():
+            digits += 1
+        if body[digits:digits + 1] == '.' and body[digits + 1:digits + 2].isspace():
+            return 'ordered', body[digits + 1:].strip()
+        return None
     
     def process_line(self, line):
         """Process a single line"""
+        # Strip once, and dispatch on the first character so that most lines
+        # skip the heading checks and list regexes entirely
+        stripped = line.strip()
+        lead = line[:1]
+        first = stripped[:1]
+        
         # Handle code blocks
-        if line.startswith('```{r'):
+        if lead == '`' and line.startswith('```{r'):
             self.flush_paragraph()
             self.flush_blockquote()
             self.flush_list()
             self.in_code_block = True
-            # Extract parameters
-            params_match = re.search(r'```\{r\s+([^}]*)\}', line)
-            if params_match:
-                params = params_match.group(1)
-                # Parse parameters
-                for param in params.split(','):
-                    param = param.strip()
-                    if '=' in param:
-                        key, val = param.split('=', 1)
-                        self.code_block_params[key.strip()] = val.strip()
+            # Only an output= option affects the block, so the chunk
+            # options are parsed only when one could be present
+            if 'output' in line:
+                params_match = self._RE_CHUNK_PARAMS.search(line)
+                if params_match:
+                    for param in params_match.group(1).split(','):
+                        key, eq, val = param.partition('=')
+                        if eq and key.strip() == 'output':
+                            self.code_block_is_output = bool(val.strip())
             return
-        elif line.strip() == '```' and not self.in_code_block:
+        elif stripped == '```' and not self.in_code_block:
             # Start of plain code block (output block)
             self.flush_paragraph()
             self.flush_blockquote()
             self.flush_list()
             self.in_code_block = True
-            self.code_block_params['output'] = True
+            self.code_block_is_output = True
             return
-        elif line.strip() == '```' and self.in_code_block:
+        elif stripped == '```' and self.in_code_block:
             self.flush_code_block()
             return
         elif self.in_code_block:
@@ -232,115 +300,97 @@ class RmdToPreTeXt:
             content = content.replace(' -- ', ' <mdash/> ')
             self.blockquote_lines.append(content)
             return
-        elif self.in_blockquote and line.strip():
+        elif self.in_blockquote and stripped:
             if line.startswith('>'):
                 content = line[1:].strip()
                 content = content.replace(' -- ', ' <mdash/> ')
                 self.blockquote_lines.append(content)
             else:
-                self.blockquote_lines.append(line.strip())
+                self.blockquote_lines.append(stripped)
             return
-        elif self.in_blockquote and not line.strip():
+        elif self.in_blockquote and not stripped:
             self.flush_blockquote()
             return
         
         # Handle headers
-        if line.startswith('# '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            # Extract title and ID
-            match = re.match(r'#\s+(.+?)\{#([^}]+)\}', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2)
-                title = self.convert_inline_formatting(title)
-                self.output.append(f'<chapter xml:id="{xml_id}">')
-                self.output.append(f'  <title>{title}</title>')
-                self.output.append('')
-                self.section_stack = ['chapter']
-            return
-        
-        elif line.startswith('## '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            match = re.match(r'##\s+(.+?)(?:\{#([^}]+)\})?$', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2) if match.group(2) else None
-                title = self.convert_inline_formatting(title)
-                
-                # Close any open subsections first
-                while len(self.section_stack) > 2:
-                    level = self.section_stack.pop()
-                    if level == 'subsection':
-                        self.output.append('    </subsection>')
-                
-                # Close previous section if needed (but not chapter)
-                if len(self.section_stack) > 1 and self.section_stack[-1] == 'section':
-                    self.section_stack.pop()
-                    self.output.append('  </section>')
-                
-                if xml_id:
-                    self.output.append(f'  <section xml:id="{xml_id}">')
-                else:
-                    self.output.append(f'  <section>')
-                self.output.append(f'    <title>{title}</title>')
-                self.output.append('')
-                
-                self.section_stack.append('section')
-            return
-        
-        elif line.startswith('### '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            match = re.match(r'###\s+(.+?)(?:\{#([^}]+)\})?$', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2) if match.group(2) else None
-                title = self.convert_inline_formatting(title)
-                
-                # Close previous subsection if needed
-                if len(self.section_stack) > 2 and self.section_stack[-1] == 'subsection':
-                    self.section_stack.pop()
-                    self.output.append('    </subsection>')
-                
-                if xml_id:
-                    self.output.append(f'    <subsection xml:id="{xml_id}">')
-                else:
-                    self.output.append(f'    <subsection>')
-                self.output.append(f'      <title>{title}</title>')
-                self.output.append('')
-                
-                self.section_stack.append('subsection')
-            return
+        if lead == '#':
+            if line.startswith('# '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                # Extract title and ID
+                match = self._RE_CHAPTER.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2)
+                    title = self.convert_inline_formatting(title)
+                    self.emit(f'<chapter xml:id="{xml_id}">', f'  <title>{title}</title>', '')
+                    self.section_stack = ['chapter']
+                return
+            
+            elif line.startswith('## '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                match = self._RE_SECTION.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2) if match.group(2) else None
+                    title = self.convert_inline_formatting(title)
+                    
+                    # Close any open subsections first
+                    while len(self.section_stack) > 2:
+                        level = self.section_stack.pop()
+                        if level == 'subsection':
+                            self.emit('    </subsection>')
+                    
+                    # Close previous section if needed (but not chapter)
+                    if len(self.section_stack) > 1 and self.section_stack[-1] == 'section':
+                        self.section_stack.pop()
+                        self.emit('  </section>')
+                    
+                    section_open = f'  <section xml:id="{xml_id}">' if xml_id else '  <section>'
+                    self.emit(section_open, f'    <title>{title}</title>', '')
+                    
+                    self.section_stack.append('section')
+                return
+            
+            elif line.startswith('### '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                match = self._RE_SUBSECTION.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2) if match.group(2) else None
+                    title = self.convert_inline_formatting(title)
+                    
+                    # Close previous subsection if needed
+                    if len(self.section_stack) > 2 and self.section_stack[-1] == 'subsection':
+                        self.section_stack.pop()
+                        self.emit('    </subsection>')
+                    
+                    subsection_open = f'    <subsection xml:id="{xml_id}">' if xml_id else '    <subsection>'
+                    self.emit(subsection_open, f'      <title>{title}</title>', '')
+                    
+                    self.section_stack.append('subsection')
+                return
         
         # Handle lists
-        if re.match(r'^\s*[\*\-]\s+', line):
+        list_item = self.split_list_item(line) if first in ('*', '-') or first.isdecimal() else None
+        if list_item:
             self.flush_paragraph()
             self.flush_blockquote()
             if not self.in_list:
                 self.in_list = True
-                self.list_type = 'unordered'
-            content = re.sub(r'^\s*[\*\-]\s+', '', line)
-            self.list_lines.append(content.strip())
+                self.list_type = list_item[0]
+            self.list_lines.append(list_item[1])
             return
-        elif re.match(r'^\s*\d+\.\s+', line):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            if not self.in_list:
-                self.in_list = True
-                self.list_type = 'ordered'
-            content = re.sub(r'^\s*\d+\.\s+', '', line)
-            self.list_lines.append(content.strip())
-            return
-        elif self.in_list and line.strip() and not line.startswith(' ') and not re.match(r'^[\*\-\d]', line):
+        elif self.in_list and stripped and not line.startswith(' ') and not self._RE_LIST_START.match(line):
             # Continuation of list item
-            self.list_lines[-1] += ' ' + line.strip()
+            self.list_lines[-1] += ' ' + stripped
             return
-        elif self.in_list and not line.strip():
+        elif self.in_list and not stripped:
             # Empty line might end list or be within list
             # For now, we'll check the next line context
             # But since we process line by line, we'll end it here
@@ -348,7 +398,7 @@ class RmdToPreTeXt:
             return
         
         # Handle empty lines
-        if not line.strip():
+        if not stripped:
             self.flush_paragraph()
             self.flush_blockquote()
             self.flush_list()
@@ -359,44 +409,38 @@ class RmdToPreTeXt:
             self.flush_list()
             self.in_paragraph = True
         
-        self.paragraph_lines.append(line.strip())
+        self.paragraph_lines.append(stripped)
     
     def convert(self, input_file, output_file):
         """Convert R Markdown file to PreTeXt XML"""
         with open(input_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Add XML declaration
-        self.output.append('<?xml version="1.0" encoding="UTF-8" ?>')
-        self.output.append('')
-        
-        # Process each line
-        for line in lines:
-            line = line.rstrip('\n')
-            self.process_line(line)
-        
-        # Flush any remaining content
-        self.flush_paragraph()
-        self.flush_blockquote()
-        self.flush_list()
-        self.flush_code_block()
-        
-        # Close all open sections in proper order
-        while len(self.section_stack) > 1:
-            level = self.section_stack.pop()
-            if level == 'subsection':
-                self.output.append('    </subsection>')
-            elif level == 'section':
-                self.output.append('  </section>')
-        
-        # Close chapter
-        if self.section_stack and self.section_stack[0] == 'chapter':
-            self.output.append('</chapter>')
-        
-        # Write output
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(self.output))
-            f.write('\n')
+            # One C-level split, which also drops the newlines
+            lines = f.read().splitlines()
+        
+        # Stream the XML to the output file as it is generated
+        with open(output_file, 'w', encoding='utf-8') as self.out:
+            # Add XML declaration
+            self.emit('<?xml version="1.0" encoding="UTF-8" ?>')
+            self.emit('')
+            
+            # Process each line
+            for line in lines:
+                self.process_line(line)
+            
+            # Flush any remaining content
+            self.flush_paragraph()
+            self.flush_blockquote()
+            self.flush_list()
+            self.flush_code_block()
+            
+            # Close all open sections in proper order, then the chapter,
+            # with one write
+            closers = [self._CLOSING_TAGS[level] for level in reversed(self.section_stack[1:])]
+            if self.section_stack and self.section_stack[0] == 'chapter':
+                closers.append('</chapter>')
+            self.emit(*closers)
+            self.out.write('\n')
+        self.out = None
         
         print(f"Conversion complete: {output_file}")
 
@@ -8,12 +8,54 @@ import re
 import sys
 
 class RmdToPreTeXt:
+    # Inline markup
+    _RE_CODE = re.compile(r'`([^`]+)`')
+    _RE_DISPLAY_MATH = re.compile(r'\$\$(.+?)\$\$', re.DOTALL)
+    _RE_INLINE_MATH = re.compile(r'\$([^\$]+?)\$')
+    # Bold + italic, bold and italic in one pass; every form becomes <em>.
+    # At each position the first alternative wins, so ***x*** is never read
+    # as **x** wrapped in stray asterisks. ___x___ keeps its inner _x_ so
+    # that it nests as <em><em>x</em></em>, as separate passes made it.
+    # Every alternative starts with a literal '*' or '_' (the _text_
+    # lookbehind comes after its '_'), so the scan can skip straight to the
+    # next candidate.
+    _RE_EMPHASIS = re.compile(
+        r'\*\*\*(?P<bold_italic>.+?)\*\*\*'
+        r'|\*\*_(?P<bold_und_italic>.+?)_\*\*'
+        r'|_\*\*(?P<und_bold_italic>.+?)\*\*_'
+        r'|\*\*(?P<bold>.+?)\*\*'
+        r'|__(?P<und_bold_und_italic>_[^_]+?_)__(?![_\w])'
+        r'|__(?P<und_bold>.+?)__'
+        r'|\*(?P<italic>(?:[^*]|\*\*[^*]+\*\*)+)\*'
+        r'|_(?<![_\w]_)(?P<und_italic>[^_]+?)_(?![_\w])')
+    _RE_XREF = re.compile(r'\\@ref\(([^)]+)\)')
+    _RE_FOOTNOTE = re.compile(r'\^\[([^\]]+)\]')
+    
+    # Placeholders left by the protected code and math spans
+    _RE_PLACEHOLDER = re.compile(r'~~~(CODE|MATH|DISPMATH)(\d+)~~~')
+    _RE_CODE_PLACEHOLDER = re.compile(r'~~~CODE(\d+)~~~')
+    
+    # Block structure
+    _RE_CHUNK_PARAMS = re.compile(r'```\{r\s+([^}]*)\}')
+    _RE_CHAPTER = re.compile(r'#\s+(.+?)\{#([^}]+)\}')
+    _RE_SECTION = re.compile(r'##\s+(.+?)(?:\{#([^}]+)\})?$')
+    _RE_SUBSECTION = re.compile(r'###\s+(.+?)(?:\{#([^}]+)\})?$')
+    _RE_UL = re.compile(r'^[-*]\s+')
+    _RE_OL = re.compile(r'^\d+\.\s+')
+    
+    # Closing tag for each open division
+    _CLOSING_TAGS = {
+        'chapter': '</chapter>',
+        'section': '  </section>',
+        'subsection': '    </subsection>',
+    }
+    
     def __init__(self):
-        self.output = []
+        self.out = None
+        self.line_count = 0
         self.in_code_block = False
         self.code_block_lines = []
         self.code_block_params = {}
-        self.in_paragraph = False
         self.paragraph_lines = []
         self.in_list = False
         self.list_lines = []
@@ -22,27 +64,34 @@ class RmdToPreTeXt:
         self.blockquote_lines = []
         self.section_stack = []
         
+    def emit(self, *lines):
+        """Write lines of XML straight to the output file"""
+        if not lines:
+            return
+        if self.line_count:
+            self.out.write('\n')
+        self.out.write('\n'.join(lines))
+        self.line_count += len(lines)
+    
     def escape_xml_text(self, text):
         """Escape XML special characters in regular text"""
+        # Most prose has nothing to escape; skip the three scans for it
+        if '&' not in text and '<' not in text and '>' not in text:
+            return text
         text = text.replace('&', '&amp;')
         text = text.replace('<', '&lt;')
         text = text.replace('>', '&gt;')
         return text
     
-    def convert_inline_formatting(self, text, escape=True):
-        """Convert inline formatting - call BEFORE escaping XML"""
-        # Protect escaped dollar signs (literal currency) FIRST
-        text = text.replace(r'\$', '___LITERAL_DOLLAR___')
-        
+    def protect_spans(self, text, code_parts, math_display_parts, math_parts):
+        """Move code and math spans into the part lists, leaving placeholders"""
         # Protect code blocks temporarily
-        code_parts = []
         def save_code(match):
             code_parts.append(match.group(1))
             return f"~~~CODE{len(code_parts)-1}~~~"
-        text = re.sub(r'`([^`]+)`', save_code, text)
+        text = self._RE_CODE.sub(save_code, text)
         
         # Convert display math $$...$$ to <me>...</me>
-        math_display_parts = []
         def save_display_math(match):
             content = match.group(1).strip()
             # Use CDATA for LaTeX content to avoid XML parsing issues
@@ -51,10 +100,9 @@ class RmdToPreTeXt:
             else:
                 math_display_parts.append(f'<me>{content}</me>')
             return f"~~~DISPMATH{len(math_display_parts)-1}~~~"
-        text = re.sub(r'\$\$(.+?)\$\$', save_display_math, text, flags=re.DOTALL)
+        text = self._RE_DISPLAY_MATH.sub(save_display_math, text)
         
         # Convert inline math $...$ to <m>...</m>
-        math_parts = []
         def save_inline_math(match):
             content = match.group(1)
             # Use CDATA for complex LaTeX
@@ -63,63 +111,102 @@ class RmdToPreTeXt:
             else:
                 math_parts.append(f'<m>{content}</m>')
             return f"~~~MATH{len(math_parts)-1}~~~"
-        text = re.sub(r'\$([^\$]+?)\$', save_inline_math, text)
+        return self._RE_INLINE_MATH.sub(save_inline_math, text)
+    
+    def restore_spans(self, text, code_parts, math_display_parts, math_parts):
+        """Put the protected spans back in place of their placeholders"""
+        if not (code_parts or math_display_parts or math_parts):
+            return text
+        
+        # Escape XML special characters in inline code
+        code_parts = [f'<c>{self.escape_xml_text(code)}</c>' for code in code_parts]
+        parts = {'CODE': code_parts, 'DISPMATH': math_display_parts, 'MATH': math_parts}
+        
+        # Restore every span in one pass over the text. Math can enclose code
+        # placeholders, which are restored inside it. A placeholder with no
+        # span in these lists (a paragraph's, seen from one of its footnotes)
+        # is left as is.
+        def restore_code(match):
+            i = int(match.group(1))
+            return code_parts[i] if i < len(code_parts) else match.group(0)
+        def restore(match):
+            kind, i = match.group(1), int(match.group(2))
+            if i >= len(parts[kind]):
+                return match.group(0)
+            span = parts[kind][i]
+            if kind != 'CODE' and '~~~CODE' in span:
+                span = self._RE_CODE_PLACEHOLDER.sub(restore_code, span)
+            return span
+        return self._RE_PLACEHOLDER.sub(restore, text)
+    
+    def convert_inline_formatting(self, text, escape=True):
+        """Convert inline formatting - call BEFORE escaping XML"""
+        # Most text has no markup at all, and then only escaping applies
+        if ('$' not in text and '`' not in text and '*' not in text and '_' not in text
+                and '\\@ref(' not in text and '^[' not in text):
+            return self.escape_xml_text(text) if escape else text
+        
+        # Protect escaped dollar signs (literal currency) FIRST. The stand-in
+        # is a control character, which can never occur in Rmd source and,
+        # unlike an underscore-delimited word, is never taken for markup.
+        has_literal_dollar = '\\$' in text
+        if has_literal_dollar:
+            text = text.replace('\\$', '\x01')
+        
+        # Protect code and math
+        code_parts, math_display_parts, math_parts = [], [], []
+        if '$' in text or '`' in text:
+            text = self.protect_spans(text, code_parts, math_display_parts, math_parts)
         
         # Escape XML AFTER protecting math and code
         if escape:
             text = self.escape_xml_text(text)
         
         # Convert markdown formatting
-        # Bold + italic: ***text*** or **_text_** or _**text**_ 
-        text = re.sub(r'\*\*\*(.+?)\*\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'\*\*_(.+?)_\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'_\*\*(.+?)\*\*_', r'<em>\1</em>', text)
-        
-        # Bold: **text** or __text__
-        text = re.sub(r'\*\*(.+?)\*\*', r'<em>\1</em>', text)
-        text = re.sub(r'__(.+?)__', r'<em>\1</em>', text)
-        
-        # Italic: *text* or _text_
-        text = re.sub(r'\*([^\*]+?)\*', r'<em>\1</em>', text)
-        text = re.sub(r'(?<![_\w])_([^_]+?)_(?![_\w])', r'<em>\1</em>', text)
+        text = self.convert_emphasis(text)
         
         # Cross-references: \@ref(id) -> <xref ref="id"/>
-        text = re.sub(r'\\@ref\(([^)]+)\)', r'<xref ref="\1"/>', text)
+        if '\\@ref(' in text:
+            text = self._RE_XREF.sub(r'<xref ref="\1"/>', text)
         
-        # Footnotes: ^[text] -> <fn>text</fn>
+        # Footnotes: ^[text] -> <fn>text</fn>. The body was escaped and
+        # formatted along with the rest of the text; only backticks and
+        # dollars that pair up differently within it are left to handle,
+        # with the emphasis those spans then expose.
         def convert_footnote(match):
             content = match.group(1)
-            content = self.convert_inline_formatting(content, escape=False)
+            if '$' in content or '`' in content:
+                fn_parts = [], [], []
+                content = self.protect_spans(content, *fn_parts)
+                content = self.restore_spans(self.convert_emphasis(content), *fn_parts)
+            else:
+                content = self.convert_emphasis(content)
             return f'<fn>{content}</fn>'
-        text = re.sub(r'\^\[([^\]]+)\]', convert_footnote, text)
-        
-        # Restore display math
-        for i, math in enumerate(math_display_parts):
-            text = text.replace(f"~~~DISPMATH{i}~~~", math)
+        if '^[' in text:
+            text = self._RE_FOOTNOTE.sub(convert_footnote, text)
         
-        # Restore inline math
-        for i, math in enumerate(math_parts):
-            text = text.replace(f"~~~MATH{i}~~~", math)
-        
-        # Restore code (escape XML chars in code content)
-        for i, code in enumerate(code_parts):
-            # Escape XML special characters in inline code
-            code_escaped = code.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-            text = text.replace(f"~~~CODE{i}~~~", f'<c>{code_escaped}</c>')
+        text = self.restore_spans(text, code_parts, math_display_parts, math_parts)
         
         # Restore literal dollar signs
-        text = text.replace('___LITERAL_DOLLAR___', '$')
+        if has_literal_dollar:
+            text = text.replace('\x01', '$')
         
         return text
     
+    def convert_emphasis(self, text):
+        """Convert markdown bold/italic to <em>, including nested emphasis"""
+        if '*' not in text and '_' not in text:
+            return text
+        return self._RE_EMPHASIS.sub(
+            lambda m: f'<em>{self.convert_emphasis(m.group(m.lastgroup))}</em>', text)
+    
     def flush_paragraph(self):
         """Flush accumulated paragraph lines"""
         if self.paragraph_lines:
             content = ' '.join(self.paragraph_lines)
             content = self.convert_inline_formatting(content)
-            self.output.append(f"    <p>{content}</p>")
+            self.emit(f"    <p>{content}</p>")
             self.paragraph_lines = []
-            self.in_paragraph = False
     
     def flush_blockquote(self):
         """Flush accumulated blockquote lines"""
@@ -134,17 +221,11 @@ class RmdToPreTeXt:
                 if len(parts) == 2:
                     text_part = parts[0].strip()
                     author_part = parts[1].strip()
-                    self.output.append(f'    <blockquote>')
-                    self.output.append(f'      <p>{text_part}</p>')
-                    self.output.append(f'    </blockquote>')
+                    self.emit('    <blockquote>', f'      <p>{text_part}</p>', '    </blockquote>')
                 else:
-                    self.output.append(f'    <blockquote>')
-                    self.output.append(f'      <p>{content}</p>')
-                    self.output.append(f'    </blockquote>')
+                    self.emit('    <blockquote>', f'      <p>{content}</p>', '    </blockquote>')
             else:
-                self.output.append(f'    <blockquote>')
-                self.output.append(f'      <p>{content}</p>')
-                self.output.append(f'    </blockquote>')
+                self.emit('    <blockquote>', f'      <p>{content}</p>', '    </blockquote>')
             
             self.blockquote_lines = []
             self.in_blockquote = False
@@ -154,14 +235,11 @@ class RmdToPreTeXt:
         if not self.list_lines:
             return
         
+        # The whole list is written in one call
         list_tag = 'ul' if self.list_type == 'unordered' else 'ol'
-        self.output.append(f"    <{list_tag}>")
-        
-        for item in self.list_lines:
-            content = self.convert_inline_formatting(item)
-            self.output.append(f"      <li><p>{content}</p></li>")
-        
-        self.output.append(f"    </{list_tag}>")
+        items = [f"      <li><p>{self.convert_inline_formatting(item)}</p></li>"
+                 for item in self.list_lines]
+        self.emit(f"    <{list_tag}>", *items, f"    </{list_tag}>")
         self.list_lines = []
         self.in_list = False
         self.list_type = None
@@ -172,22 +250,18 @@ class RmdToPreTeXt:
             # Check if it's an output block
             is_output = self.code_block_params.get('output', False)
             
-            # Join code lines
-            code_content = '\n'.join(self.code_block_lines)
-            
+            # Each block is written in one call, code lines included
             if is_output:
                 # Output blocks need XML escaping or CDATA
                 # Use CDATA for output blocks to preserve formatting
-                self.output.append('    <pre><![CDATA[')
-                self.output.append(code_content)
-                self.output.append(']]></pre>')
+                self.emit('    <pre><![CDATA[', *self.code_block_lines, ']]></pre>')
             else:
                 # Use CDATA to avoid issues with < and & in code
-                self.output.append('    <program language="r">')
-                self.output.append('      <input><![CDATA[')
-                self.output.append(code_content)
-                self.output.append(']]></input>')
-                self.output.append('    </program>')
+                self.emit('    <program language="r">',
+                          '      <input><![CDATA[',
+                          *self.code_block_lines,
+                          ']]></input>',
+                          '    </program>')
             
             self.code_block_lines = []
             self.in_code_block = False
@@ -195,14 +269,25 @@ class RmdToPreTeXt:
     
     def process_line(self, line):
         """Process a single line"""
+        # A code line without a backtick cannot be a fence, so it is taken
+        # as is, without stripping or any of the checks below
+        if self.in_code_block and '`' not in line:
+            self.code_block_lines.append(line)
+            return
+        
+        # Strip once, and dispatch on the first character so that most lines
+        # skip the heading checks and list regexes entirely
+        stripped = line.strip()
+        lead = line[:1]
+        
         # Handle code blocks
-        if line.startswith('```{r'):
+        if lead == '`' and line.startswith('```{r'):
             self.flush_paragraph()
             self.flush_blockquote()
             self.flush_list()
             self.in_code_block = True
             # Extract parameters
-            params_match = re.search(r'```\{r\s+([^}]*)\}', line)
+            params_match = self._RE_CHUNK_PARAMS.search(line)
             if params_match:
                 params = params_match.group(1)
                 # Parse parameters
@@ -212,7 +297,7 @@ class RmdToPreTeXt:
                         key, val = param.split('=', 1)
                         self.code_block_params[key.strip()] = val.strip()
             return
-        elif line.strip() == '```' and not self.in_code_block:
+        elif stripped == '```' and not self.in_code_block:
             # Start of plain code block (output block)
             self.flush_paragraph()
             self.flush_blockquote()
@@ -220,7 +305,7 @@ class RmdToPreTeXt:
             self.in_code_block = True
             self.code_block_params['output'] = True
             return
-        elif line.strip() == '```' and self.in_code_block:
+        elif stripped == '```' and self.in_code_block:
             self.flush_code_block()
             return
         elif self.in_code_block:
@@ -235,129 +320,119 @@ class RmdToPreTeXt:
             content = line[2:].strip()
             self.blockquote_lines.append(content)
             return
-        elif self.in_blockquote and line.strip():
+        elif self.in_blockquote and stripped:
             if line.startswith('>'):
                 content = line[1:].strip()
                 self.blockquote_lines.append(content)
             else:
-                self.blockquote_lines.append(line.strip())
+                self.blockquote_lines.append(stripped)
             return
-        elif self.in_blockquote and not line.strip():
+        elif self.in_blockquote and not stripped:
             self.flush_blockquote()
             return
         
         # Handle headers
-        if line.startswith('# '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            # Extract title and ID
-            match = re.match(r'#\s+(.+?)\{#([^}]+)\}', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2)
-                title = self.convert_inline_formatting(title)
-                self.output.append(f'<chapter xml:id="{xml_id}">')
-                self.output.append(f'  <title>{title}</title>')
-                self.output.append('')
-                self.section_stack = ['chapter']
-            return
-        
-        elif line.startswith('## '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            match = re.match(r'##\s+(.+?)(?:\{#([^}]+)\})?$', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2) if match.group(2) else None
-                title = self.convert_inline_formatting(title)
-                
-                # Close any open subsections first
-                while len(self.section_stack) > 2:
-                    level = self.section_stack.pop()
-                    if level == 'subsection':
-                        self.output.append('    </subsection>')
-                
-                # Close previous section if needed (but not chapter)
-                if len(self.section_stack) > 1 and self.section_stack[-1] == 'section':
-                    self.section_stack.pop()
-                    self.output.append('  </section>')
-                
-                if xml_id:
-                    self.output.append(f'  <section xml:id="{xml_id}">')
-                else:
-                    self.output.append(f'  <section>')
-                self.output.append(f'    <title>{title}</title>')
-                self.output.append('')
-                
-                self.section_stack.append('section')
-            return
-        
-        elif line.startswith('### '):
-            self.flush_paragraph()
-            self.flush_blockquote()
-            self.flush_list()
-            match = re.match(r'###\s+(.+?)(?:\{#([^}]+)\})?$', line)
-            if match:
-                title = match.group(1).strip()
-                xml_id = match.group(2) if match.group(2) else None
-                title = self.convert_inline_formatting(title)
-                
-                # Close any existing subsection (but not section or chapter)
-                if len(self.section_stack) > 2 and self.section_stack[-1] == 'subsection':
-                    self.section_stack.pop()
-                    self.output.append('    </subsection>')
-                
-                if xml_id:
-                    self.output.append(f'    <subsection xml:id="{xml_id}">')
-                else:
-                    self.output.append(f'    <subsection>')
-                self.output.append(f'      <title>{title}</title>')
-                self.output.append('')
-                
-                self.section_stack.append('subsection')
-            return
+        if lead == '#':
+            if line.startswith('# '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                # Extract title and ID
+                match = self._RE_CHAPTER.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2)
+                    title = self.convert_inline_formatting(title)
+                    self.emit(f'<chapter xml:id="{xml_id}">', f'  <title>{title}</title>', '')
+                    self.section_stack = ['chapter']
+                return
+            
+            elif line.startswith('## '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                match = self._RE_SECTION.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2) if match.group(2) else None
+                    title = self.convert_inline_formatting(title)
+                    
+                    # Close any open subsections first, with one write
+                    closers = [self._CLOSING_TAGS[level] for level in reversed(self.section_stack[2:])
+                               if level == 'subsection']
+                    self.emit(*closers)
+                    del self.section_stack[2:]
+                    
+                    # Close previous section if needed (but not chapter)
+                    if len(self.section_stack) > 1 and self.section_stack[-1] == 'section':
+                        self.section_stack.pop()
+                        self.emit('  </section>')
+                    
+                    section_open = f'  <section xml:id="{xml_id}">' if xml_id else '  <section>'
+                    self.emit(section_open, f'    <title>{title}</title>', '')
+                    
+                    self.section_stack.append('section')
+                return
+            
+            elif line.startswith('### '):
+                self.flush_paragraph()
+                self.flush_blockquote()
+                self.flush_list()
+                match = self._RE_SUBSECTION.match(line)
+                if match:
+                    title = match.group(1).strip()
+                    xml_id = match.group(2) if match.group(2) else None
+                    title = self.convert_inline_formatting(title)
+                    
+                    # Close any existing subsection (but not section or chapter)
+                    if len(self.section_stack) > 2 and self.section_stack[-1] == 'subsection':
+                        self.section_stack.pop()
+                        self.emit('    </subsection>')
+                    
+                    subsection_open = f'    <subsection xml:id="{xml_id}">' if xml_id else '    <subsection>'
+                    self.emit(subsection_open, f'      <title>{title}</title>', '')
+                    
+                    self.section_stack.append('subsection')
+                return
         
         # Handle lists
-        if re.match(r'^[-*]\s+', line):
+        if lead in ('-', '*') and self._RE_UL.match(line):
             if not self.in_list:
                 self.flush_paragraph()
                 self.flush_blockquote()
                 self.in_list = True
                 self.list_type = 'unordered'
-            item = re.sub(r'^[-*]\s+', '', line).strip()
+            item = self._RE_UL.sub('', line).strip()
             self.list_lines.append(item)
             return
-        elif re.match(r'^\d+\.\s+', line):
+        elif lead.isdecimal() and self._RE_OL.match(line):
             if not self.in_list:
                 self.flush_paragraph()
                 self.flush_blockquote()
                 self.in_list = True
                 self.list_type = 'ordered'
-            item = re.sub(r'^\d+\.\s+', '', line).strip()
+            item = self._RE_OL.sub('', line).strip()
             self.list_lines.append(item)
             return
-        elif self.in_list and line.strip() and not line.startswith(' '):
+        elif self.in_list and stripped and not line.startswith(' '):
             # Continue list item on next line
             if self.list_lines:
-                self.list_lines[-1] += ' ' + line.strip()
+                self.list_lines[-1] += ' ' + stripped
             return
-        elif self.in_list and not line.strip():
+        elif self.in_list and not stripped:
             self.flush_list()
             return
         
         # Handle empty lines
-        if not line.strip():
+        if not stripped:
             self.flush_paragraph()
             self.flush_blockquote()
             self.flush_list()
             return
         
-        # Handle regular paragraph text
-        if not self.in_paragraph:
-            self.in_paragraph = True
-        self.paragraph_lines.append(line.strip())
+        # Handle regular paragraph text; a non-empty paragraph_lines is the
+        # open paragraph
+        self.paragraph_lines.append(stripped)
     
     def finalize(self):
         """Finalize conversion and close all open tags"""
@@ -366,37 +441,28 @@ class RmdToPreTeXt:
         self.flush_list()
         self.flush_code_block()
         
-        # Close all open sections
-        while len(self.section_stack) > 0:
-            level = self.section_stack.pop()
-            if level == 'subsection':
-                self.output.append('    </subsection>')
-            elif level == 'section':
-                self.output.append('  </section>')
-            elif level == 'chapter':
-                self.output.append('</chapter>')
+        # Close all open sections, innermost first, with one write
+        self.emit(*[self._CLOSING_TAGS[level] for level in reversed(self.section_stack)])
+        self.section_stack.clear()
     
     def convert(self, input_file, output_file):
         """Main conversion method"""
-        # Add XML header
-        self.output.append('<?xml version="1.0" encoding="UTF-8" ?>')
-        self.output.append('')
-        
-        # Read and process input file
-        with open(input_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.rstrip('\n')
+        # Stream the XML to the output file as it is generated
+        with open(input_file, 'r', encoding='utf-8') as f, \
+                open(output_file, 'w', encoding='utf-8', buffering=1 << 16) as self.out:
+            # Add XML header
+            self.emit('<?xml version="1.0" encoding="UTF-8" ?>', '')
+            
+            # Read and process input file; one C-level split drops the newlines
+            for line in f.read().splitlines():
                 self.process_line(line)
-        
-        # Finalize
-        self.finalize()
-        
-        # Write output
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(self.output))
+            
+            # Finalize
+            self.finalize()
+        self.out = None
         
         print(f"Conversion complete: {output_file}")
-        print(f"Total lines: {len(self.output)}")
+        print(f"Total lines: {self.line_count}")
 
 if __name__ == '__main__':
     converter = RmdToPreTeXt()
@@ -0,0 +1,28 @@
+import unittest
+
+from convert_ch4_statistical_theory import RmdToPreTeXt
+
+
+class InlineFormattingTest(unittest.TestCase):
+    def convert(self, text):
+        return RmdToPreTeXt.convert_inline_formatting(text)
+    
+    def test_escaped_dollar_next_to_math(self):
+        self.assertEqual(self.convert(r'costs \$5 and $x$ here'),
+                         'costs $5 and <m>x</m> here')
+        self.assertEqual(self.convert(r'$a$ \$ and \$ $b$'),
+                         '<m>a</m> $ and $ <m>b</m>')
+    
+    def test_footnote_pairs_backticks_differently(self):
+        # The paragraph pairs the inner backticks of ``y``, leaving the
+        # outer ones for the footnote to pair around that code span
+        self.assertEqual(self.convert('p `x` and $m$ ^[n ``y`` and $k$] end'),
+                         'p <c>x</c> and <m>m</m> <fn>n <c><c>y</c></c> and <m>k</m></fn> end')
+    
+    def test_triple_underscore_nests(self):
+        self.assertEqual(self.convert('___x___'), '<em><em>x</em></em>')
+        self.assertEqual(self.convert('a ___b c___ d'), 'a <em><em>b c</em></em> d')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from convert_ch5_anova2 import process_inline_formatting
+
+
+class ProcessInlineFormattingTest(unittest.TestCase):
+    def test_italic_wrapping_bold(self):
+        self.assertEqual(process_inline_formatting('*a **b** c*'),
+                         '<em>a <em>b</em> c</em>')
+
+    def test_italic_ending_in_bold(self):
+        self.assertEqual(process_inline_formatting('*Why **common sense?***'),
+                         '<em>Why <em>common sense?</em></em>')
+
+    def test_separate_italics(self):
+        self.assertEqual(process_inline_formatting('*x* and *y*'),
+                         '<em>x</em> and <em>y</em>')
+
+    def test_math_is_not_reformatted(self):
+        self.assertEqual(process_inline_formatting(r'$\epsilon_i$ and $x_j$'),
+                         r'<m>\epsilon_i</m> and <m>x_j</m>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from convert_ch5_complete import RmdToPreTeXt
+
+RMD_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'bookdown', '03.05-descriptives.Rmd')
+
+
+class ConvertStringTest(unittest.TestCase):
+    def test_matches_convert_output(self):
+        with open(RMD_FILE, encoding='utf-8') as f:
+            rmd_text = f.read()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            output_file = os.path.join(tmp, 'out.ptx')
+            with contextlib.redirect_stdout(io.StringIO()):
+                RmdToPreTeXt().convert(RMD_FILE, output_file)
+            with open(output_file, encoding='utf-8') as f:
+                written = f.read()
+        
+        self.assertEqual(RmdToPreTeXt().convert_string(rmd_text), written)
+    
+    def test_reused_instance(self):
+        with open(RMD_FILE, encoding='utf-8') as f:
+            rmd_text = f.read()
+        
+        converter = RmdToPreTeXt()
+        first = converter.convert_string(rmd_text)
+        self.assertEqual(converter.convert_string(rmd_text), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from convert_ch_regression import RmdToPreTeXt
+
+
+class FootnoteFormattingTest(unittest.TestCase):
+    def convert(self, text):
+        return RmdToPreTeXt().convert_inline_formatting(text)
+    
+    def assertNoPlaceholders(self, text):
+        for leftover in ('~~~CODE', '~~~MATH', '~~~DISPMATH', '\x01'):
+            self.assertNotIn(leftover, text)
+    
+    def test_code_and_math_in_paragraph_and_footnote(self):
+        result = self.convert('p `x` and $m$ ^[n `y` and $k$] end')
+        self.assertEqual(result, 'p <c>x</c> and <m>m</m> <fn>n <c>y</c> and <m>k</m></fn> end')
+        self.assertNoPlaceholders(result)
+    
+    def test_footnote_pairs_backticks_differently(self):
+        # The paragraph pairs the inner backticks of ``y``, leaving its code
+        # placeholder inside the code span the footnote pairs around it
+        result = self.convert('p `x` and $m$ ^[n ``y`` and $k$] end')
+        self.assertEqual(result,
+                         'p <c>x</c> and <m>m</m> <fn>n <c><c>y</c></c> and <m>k</m></fn> end')
+        self.assertNoPlaceholders(result)
+    
+    def test_escaped_dollars_around_footnote(self):
+        result = self.convert(r'p `a<b` \$2 ^[see ``$z$`` and \$3 $$w$$] end')
+        self.assertEqual(result,
+                         'p <c>a&lt;b</c> $2 <fn>see <c><c>$z$</c></c> and $3 <me>w</me></fn> end')
+        self.assertNoPlaceholders(result)
+
+
+if __name__ == '__main__':
+    unittest.main()